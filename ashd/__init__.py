@@ -4,5 +4,8 @@ from .butler import Butler
 from .image import ASHDImage
 from .display import Display
 from .params import PipeParams
+from .tileindex import TileIndex
+from .scheduler import Scheduler, tile_costs
+from .stagecache import StageCache
 from .imutils import *
 from .utils import *
@@ -2,59 +2,181 @@ from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
 import os
-import re
 import numpy as np
 import pandas as pd
 from astropy import units as u
 from astropy.coordinates import SkyCoord
 from astropy.io import fits
+from scipy.spatial import cKDTree
+from . import utils
+from . import imutils
 from .image import ASHDImage
+from .tileindex import TileIndex
 
 class Butler(object):
     """
     Fetch ASAS-SN stacked images. 
     """
 
-    def __init__(self, data_dir):
+    def __init__(self, data_dir, index_fn=None, update_index=True, 
+                 files=None):
         self.data_dir = data_dir
-        self.files = [file for file in os.listdir(self.data_dir) if file[-4:]=='fits']
-        ra_vals = []
-        dec_vals = []
-        for f in self.files:
-            _ra = int(f[1:5])
-            if _ra > 2400:
-                _ra = _ra - 2400
-            _ra = str(_ra).zfill(4)
-            ra_vals.append(_ra[:2]+':'+_ra[2:]+':00')
-            dec_vals.append(f[5:8])
-        self.fn_coords = SkyCoord(ra_vals, dec_vals, unit=(u.hourangle, u.deg))
-        ra_vals = self.fn_coords.ra.value 
-        dec_vals = self.fn_coords.dec.value 
-        df = pd.DataFrame(dict(ra=ra_vals, dec=dec_vals))
+        # files is the file list of another Butler (e.g., in the main 
+        # process) whose field ids this one must share; the index on 
+        # disk is only trusted if it lists exactly those files
+        self.index = TileIndex(data_dir, index_fn=index_fn, 
+                               update=update_index and files is None)
+        if files is not None and self.index.files != list(files):
+            self.index.update()
+            if self.index.files != list(files):
+                raise RuntimeError(
+                    'the stacks in {} changed; field ids would not '
+                    'match'.format(data_dir))
+        self.files = self.index.files
+        self.fn_coords = SkyCoord(
+            self.index['ra'], self.index['dec'], unit='deg')
+        df = pd.DataFrame(dict(ra=self.index['ra'], dec=self.index['dec']))
+        # files that share a tile center belong to the same field
+        self.field_ids = df.groupby(['ra', 'dec'], sort=False).ngroup().values
         df.drop_duplicates(inplace=True)
         self.unique_coords = SkyCoord(
-            df.ra.values, df.dec.values, unit=(u.hourangle, u.deg))
-        
-    def get_image_fn(self, ra, dec=None, unit='deg'):
+            df.ra.values, df.dec.values, unit='deg')
+        self.field_files = [[] for _ in range(len(df))]
+        for i, field_id in enumerate(self.field_ids):
+            self.field_files[field_id].append(i)
+        self.tree = cKDTree(utils.radec_to_xyz(df.ra.values, df.dec.values))
+        # resolve fields with several stacks by SB_SIG once per archive
+        self.file_ids = {fn: i for i, fn in enumerate(self.files)}
+        sb_sig = self.index['sb_sig']
+        self.field_choice = np.array(
+            [f[np.argmax(sb_sig[f])] if len(f)>1 else f[0] 
+             for f in self.field_files], dtype=int)
+        self.paths = np.array(
+            [os.path.join(self.data_dir, fn) for fn in self.files])
+
+    def _to_radec(self, ra, dec=None, unit='deg'):
         #ra can also be the entire SkyCoord here
-        coord = SkyCoord(ra, dec, unit=unit) if dec != None else ra
-        seps = self.fn_coords.separation(coord)
-        fn_coord = self.fn_coords[seps.argmin()].to_string('hmsdms').split()
-        fn_ra = ''.join(re.split('[a-z]', fn_coord[0])[:2])
-        fn_dec = re.split('[a-z]', fn_coord[1])[0]
-        prefix = f'F{fn_ra}{fn_dec}_'
-        fn = [f for f in self.files if prefix in f]
-        if len(fn)>1:
-            sig = []
-            for f in fn:
-                sig.append(self.get_sb_sig(image_fn=f))
-            fn = fn[np.argmax(sig)]
-        else:
-            fn = fn[0]
-        return os.path.join(self.data_dir, fn)
+        if dec is None:
+            coord = ra.icrs
+            return coord.ra.deg, coord.dec.deg
+        if unit in ('deg', u.deg) and not isinstance(ra, str):
+            return np.asarray(ra, dtype=float), np.asarray(dec, dtype=float)
+        coord = SkyCoord(ra, dec, unit=unit)
+        return coord.ra.deg, coord.dec.deg
+
+    def get_field_id(self, ra, dec=None, unit='deg'):
+        """
+        Get the id of the field (unique tile center) nearest to 
+        the given coordinates. Array inputs return an array of ids.
+        """
+        ra, dec = self._to_radec(ra, dec, unit)
+        _, field_id = self.tree.query(utils.radec_to_xyz(ra, dec))
+        return field_id
+
+    def _field_fn(self, field_id):
+        return self.paths[self.field_choice[field_id]]
+
+    def get_image_fn(self, ra, dec=None, unit='deg'):
+        return str(self._field_fn(self.get_field_id(ra, dec, unit)))
+
+    def get_image_fns(self, ra, dec=None, unit='deg'):
+        """
+        Get the nearest image file name for many positions at once.
+
+        Parameters
+        ----------
+        ra : array-like or SkyCoord
+            Right Ascension. Can also be a SkyCoord array, in which 
+            case dec must be None.
+        dec : array-like, optional
+            Declination 
+        unit : astropy.units.Unit or str, optional
+            Unit of coordinates
+
+        Returns
+        -------
+        fns : ndarray
+            Image file name for each position.
+        """
+        field_ids = np.atleast_1d(self.get_field_id(ra, dec, unit))
+        return self._field_fn(field_ids)
+
+    def group_image_fns(self, ra, dec=None, unit='deg'):
+        """
+        Group many positions by the image they fall on, so each 
+        image only needs to be opened once.
+
+        Returns
+        -------
+        groups : dict
+            {image file name: ndarray of indices into the positions}
+        """
+        fns = self.get_image_fns(ra, dec, unit)
+        unique_fns, inverse = np.unique(fns, return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        splits = np.cumsum(np.bincount(inverse))[:-1]
+        return dict(zip(unique_fns, np.split(order, splits)))
     
+    def get_cutouts(self, ra, dec=None, unit='deg', size=301, 
+                    fill_value=np.nan, write=None):
+        """
+        Make postage stamps of many positions. The positions are 
+        grouped by tile, so each tile is opened once and all of its 
+        positions are cut out in one pass (see imutils.make_cutouts).
+
+        Parameters
+        ----------
+        ra : array-like or SkyCoord
+            Right Ascension. Can also be a SkyCoord array, in which 
+            case dec must be None.
+        dec : array-like, optional
+            Declination 
+        unit : astropy.units.Unit or str, optional
+            Unit of coordinates
+        size : int, array-like, optional
+            The size (ny, nx) of the cutouts.
+        fill_value : float, optional
+            Value of stamp pixels that fall off their tile.
+        write : str, optional
+            If not None, also write the stamps to this file as one 
+            multi-extension fits file, with one image extension per 
+            position (in order) carrying the cutout's WCS.
+
+        Returns
+        -------
+        stamps : 3D ndarray
+            The cutouts, in the order of the positions.
+        image_fns : ndarray
+            Tile each cutout was made from.
+        """
+        from astropy.wcs import WCS
+        ra, dec = self._to_radec(ra, dec, unit)
+        ra, dec = np.atleast_1d(ra), np.atleast_1d(dec)
+        stamps, headers = None, [None] * len(ra)
+        image_fns = np.empty(len(ra), dtype=object)
+        for fn, idx in self.group_image_fns(ra, dec).items():
+            with fits.open(fn, memmap=True) as hdulist:
+                wcs = WCS(hdulist[0].header)
+                cutouts, origins = imutils.make_cutouts(
+                    hdulist[0].data, (ra[idx], dec[idx]), wcs=wcs, 
+                    size=size, fill_value=fill_value)
+            if stamps is None:
+                stamps = np.empty((len(ra),) + cutouts.shape[1:], 
+                                  dtype=cutouts.dtype)
+            stamps[idx] = cutouts
+            image_fns[idx] = fn
+            if write is not None:
+                for i, origin in zip(idx, origins):
+                    headers[i] = imutils.cutout_header(wcs, origin)
+        if write is not None:
+            hdulist = fits.HDUList([fits.PrimaryHDU()] + [
+                fits.ImageHDU(stamp, header) 
+                for stamp, header in zip(stamps, headers)])
+            hdulist.writeto(write, overwrite=True)
+        return stamps, image_fns
+
     def get_image(self, ra, dec=None, unit='deg'):
-        return ASHDImage(self, ra=ra, dec=dec)
+        return ASHDImage(self, ra=ra, dec=dec, unit=unit)
 
     def get_hdulist(self, ra=None, dec=None, unit='deg', image_fn=None):
         fn = image_fn if image_fn else self.get_image_fn(ra, dec, unit=unit)
@@ -71,5 +193,12 @@ class Butler(object):
     #Returns np.nan if the object has no SB_SIG
     def get_sb_sig(self, ra=None, dec=None, unit='deg', image_fn=None):
         fn = image_fn if image_fn else self.get_image_fn(ra, dec, unit=unit)
-        head = fits.getheader(os.path.join(self.data_dir, fn))
+        fn = os.path.join(self.data_dir, fn)
+        if os.path.normpath(os.path.dirname(fn)) == \
+                os.path.normpath(self.data_dir):
+            # the index is keyed by mtime, so its SB_SIG is current
+            file_id = self.file_ids.get(os.path.basename(fn))
+            if file_id is not None:
+                return self.index['sb_sig'][file_id]
+        head = fits.getheader(fn)
         return head.get('SB_SIG', np.nan)
@@ -1,3 +1,6 @@
 from .connect import connect, Session, Base
 from .tables import *
 from .ingest import ASHDIngest
+from .writer import Writer, DatabaseSink
+from .search import cone_search, box_search, build_spatial_index, source_counts
+from .columnar import sky_cell, write_catalog, read_catalog
@@ -0,0 +1,139 @@
+from __future__ import division, print_function
+
+import os
+import re
+import glob
+import numpy as np
+
+__all__ = ['sky_cell', 'write_catalog', 'read_catalog']
+
+# size of the sky cells used to partition the catalogs (degrees)
+CELL_SIZE = 10.0
+
+
+def _grid(cell_size):
+    return int(np.ceil(360 / cell_size)), int(np.ceil(180 / cell_size))
+
+
+def sky_cell(ra, dec, cell_size=CELL_SIZE):
+    """
+    Integer id of the ra, dec cell (cell_size degrees on a side) that
+    each position falls in. Used as the partition key of the catalogs.
+    """
+    n_ra, n_dec = _grid(cell_size)
+    ra_bin = np.floor((np.asarray(ra) % 360) / cell_size).astype(int)
+    dec_bin = np.floor((np.asarray(dec) + 90) / cell_size).astype(int)
+    return np.clip(dec_bin, 0, n_dec - 1) * n_ra + np.minimum(ra_bin, n_ra - 1)
+
+
+def _box_cells(ra_min, ra_max, dec_min, dec_max, cell_size=CELL_SIZE):
+    """
+    Ids of all the sky cells that overlap an ra, dec box.
+    """
+    from .search import _ra_ranges
+    n_ra, _ = _grid(cell_size)
+    dec_bins = np.arange(sky_cell(0, dec_min, cell_size) // n_ra,
+                         sky_cell(0, dec_max, cell_size) // n_ra + 1)
+    if ra_min > ra_max:
+        ra_max += 360
+    ra_bins = np.concatenate([
+        np.arange(sky_cell(lo, -90, cell_size),
+                  sky_cell(min(hi, np.nextafter(360, 0)), -90, cell_size) + 1)
+        for lo, hi in _ra_ranges(ra_min, ra_max)])
+    return (dec_bins[:, None] * n_ra + ra_bins[None, :]).ravel().tolist()
+
+
+def _image_files(path, image_label):
+    """
+    The files that write_catalog wrote for an image, in all cells.
+    """
+    fns = glob.glob(os.path.join(glob.escape(path), 'sky_cell=*',
+                                 glob.escape(image_label) + '-*.parquet'))
+    # not those of labels that extend this one (e.g., tile-1-2)
+    pattern = re.compile(re.escape(image_label) + r'-\d+\.parquet$')
+    return [fn for fn in fns if pattern.match(os.path.basename(fn))]
+
+
+def write_catalog(catalog, path, image_label, cell_size=CELL_SIZE):
+    """
+    Write a source catalog to a Parquet dataset partitioned by sky
+    cell (hive-style sky_cell=N directories). Each image writes its
+    own files per cell, and rerunning an image first deletes its
+    previous files in every cell, so none of its old rows remain.
+    Requires pyarrow.
+
+    Parameters
+    ----------
+    catalog : pandas.DataFrame
+        Source catalog with ra and dec columns.
+    path : str
+        Root directory of the dataset (e.g., one per run).
+    image_label : str
+        Label of the image the catalog comes from.
+    cell_size : float, optional
+        Size of the sky cells in degrees.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    catalog = catalog.assign(
+        image_label=image_label,
+        sky_cell=sky_cell(catalog.ra.values, catalog.dec.values, cell_size))
+    # sorted by dec so row-group statistics can skip data on read
+    catalog = catalog.sort_values(['sky_cell', 'dec'])
+    table = pa.Table.from_pandas(catalog, preserve_index=False)
+    for fn in _image_files(path, image_label):
+        os.remove(fn)
+    ds.write_dataset(
+        table, path, format='parquet',
+        partitioning=ds.partitioning(
+            pa.schema([('sky_cell', pa.int64())]), flavor='hive'),
+        basename_template=image_label + '-{i}.parquet',
+        existing_data_behavior='overwrite_or_ignore')
+
+
+def read_catalog(path, columns=None, ra_range=None, dec_range=None,
+                 filter=None, cell_size=CELL_SIZE):
+    """
+    Read a catalog written by write_catalog, touching only the requested
+    columns and the sky cells that overlap the requested region.
+    Requires pyarrow.
+
+    Parameters
+    ----------
+    path : str
+        Root directory of the dataset.
+    columns : list of str, optional
+        Columns to read. Default is all.
+    ra_range : tuple, optional
+        (ra_min, ra_max) in degrees. If ra_min > ra_max, the range
+        wraps through ra = 0.
+    dec_range : tuple, optional
+        (dec_min, dec_max) in degrees.
+    filter : pyarrow.dataset.Expression, optional
+        Additional predicate, e.g. ds.field('mag_auto') < 18.
+    cell_size : float, optional
+        Size of the sky cells the dataset was written with.
+
+    Returns
+    -------
+    catalog : pandas.DataFrame
+        The selected rows and columns.
+    """
+    import pyarrow.dataset as ds
+    dataset = ds.dataset(path, format='parquet', partitioning='hive')
+    expr = filter
+    if ra_range is not None or dec_range is not None:
+        ra_min, ra_max = ra_range if ra_range is not None else (0, 360)
+        dec_min, dec_max = dec_range if dec_range is not None else (-90, 90)
+        cells = _box_cells(ra_min, ra_max, dec_min, dec_max, cell_size)
+        box = ds.field('sky_cell').isin(cells) & \
+              (ds.field('dec') >= dec_min) & (ds.field('dec') <= dec_max)
+        if ra_range is not None:
+            ra = ds.field('ra')
+            if ra_min > ra_max:
+                box = box & ((ra >= ra_min) | (ra <= ra_max))
+            else:
+                box = box & (ra >= ra_min) & (ra <= ra_max)
+        expr = box if expr is None else expr & box
+    table = dataset.to_table(columns=columns, filter=expr)
+    return table.to_pandas()
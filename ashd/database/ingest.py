@@ -1,7 +1,7 @@
 from __future__ import division, print_function
 
-
-from sqlalchemy import exists
+import numpy as np
+from sqlalchemy import exists, text
 from sqlalchemy.sql import func, and_
 
 from .tables import Run, Image, Source
@@ -17,41 +17,113 @@ class ASHDIngest(object):
         self.run_name = run_name 
         self.session = session
         self.current_image_id = None
-        run_query = self.session.query(Run).filter(Run.name==run_name)
-        num_rows = run_query.count()
-        if num_rows==0:
-            self.session.add(Run(name=run_name))
+        runs = self.session.query(Run).filter(Run.name==run_name).all()
+        if len(runs)==0:
+            run = Run(name=run_name)
+            self.session.add(run)
+            self.session.flush()
+            self.run_id = run.id
             self.session.commit()
-            self.run_id =  self._get_current_id(Run.id)
-        elif num_rows==1:
-            self.run_id = run_query.first().id
+        elif len(runs)==1:
+            self.run_id = runs[0].id
         else:
-            print('Warning {} rows in run name {}'.format(num_rows, run_name))
+            print('Warning {} rows in run name {}'.format(len(runs), run_name))
 
     def _get_current_id(self, table_id):
         return self.session.query(func.max(table_id)).first()[0]
         
     def add_image(self, image_label):
-        image_query = self.session.query(Image).filter(
-            and_(Image.label ==image_label, Image.run_id==self.run_id))
-        num_rows = image_query.count()
-        if num_rows==0:
-            self.session.add(Image(label=image_label, run_id=self.run_id))
+        images = self.session.query(Image.id).filter(
+            and_(Image.label ==image_label, Image.run_id==self.run_id)).all()
+        if len(images)==0:
+            image = Image(label=image_label, run_id=self.run_id)
+            self.session.add(image)
+            self.session.flush()
+            self.current_image_id = image.id
             self.session.commit()
-            self.current_image_id = self._get_current_id(Image.id)
-        elif num_rows==1:
-            self.current_image_id = image_query.first().id
+        elif len(images)==1:
+            self.current_image_id = images[0].id
         else:
-            print('Warning {} rows with image name {}'.format(num_rows, image_label))
+            print('Warning {} rows with image name {}'.format(len(images), image_label))
 
     def add_catalog(self, catalog):
         """
         """
         assert self.current_image_id is not None
         catalog['image_id'] = self.current_image_id
-        catalog.to_sql('source', self.session.bind, 
+        max_id = self._get_current_id(Source.id) or 0
+        # on the session's connection, so the sources and their index
+        # rows commit together
+        catalog.to_sql('source', self.session.connection(), 
                        if_exists='append', index=False)
+        self.session.execute(text(
+            'INSERT OR REPLACE INTO source_rtree SELECT id, ra, ra, dec, dec '
+            'FROM source WHERE id > :max_id'), dict(max_id=max_id))
+        self.session.commit()
 
     def add_all(self, image_label, catalog): 
         self.add_image(image_label)
         self.add_catalog(catalog)
+
+    def _get_image_id(self, cursor, image_label):
+        row = cursor.execute(
+            'SELECT id FROM image WHERE label=? AND run_id=?', 
+            (image_label, self.run_id)).fetchone()
+        if row is not None:
+            return row[0]
+        cursor.execute('INSERT INTO image (label, run_id) VALUES (?, ?)',
+                       (image_label, self.run_id))
+        return cursor.lastrowid
+
+    def add_batch(self, batch, fast_pragmas=True):
+        """
+        Bulk ingest the catalogs of many images in one transaction,
+        with a single executemany over native column arrays for all 
+        of their sources (instead of DataFrame.to_sql per image). 
+
+        Parameters
+        ----------
+        batch : list of (str, pandas.DataFrame)
+            (image_label, catalog) pairs. Catalog columns that are not
+            in the source table are ignored and missing nullable 
+            columns are NULL.
+        fast_pragmas : bool, optional
+            If True, switch the database to WAL journaling and use 
+            synchronous=NORMAL on this connection, which is still 
+            safe against application crashes but skips an fsync 
+            per transaction.
+        """
+        if len(batch)==0:
+            return
+        self.session.commit()
+        cursor = self.session.connection().connection.cursor()
+        if fast_pragmas:
+            # must be set outside of a transaction
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+
+        columns = [c.name for c in Source.__table__.columns 
+                   if c.name not in ('id', 'image_id')]
+        values = {c: [] for c in columns + ['image_id']}
+        for image_label, catalog in batch:
+            image_id = self._get_image_id(cursor, image_label)
+            num_rows = len(catalog)
+            for c in columns:
+                if c in catalog:
+                    values[c].append(catalog[c].values)
+                else:
+                    values[c].append(np.full(num_rows, None))
+            values['image_id'].append(np.full(num_rows, image_id))
+            self.current_image_id = image_id
+
+        columns.append('image_id')
+        # tolist gives python scalars, which sqlite binds natively
+        rows = zip(*[np.concatenate(values[c]).tolist() for c in columns])
+        max_id = cursor.execute(
+            'SELECT coalesce(max(id), 0) FROM source').fetchone()[0]
+        cursor.executemany('INSERT INTO source ({}) VALUES ({})'.format(
+            ', '.join(columns), ', '.join(['?']*len(columns))), rows)
+        cursor.execute('INSERT OR REPLACE INTO source_rtree '
+                       'SELECT id, ra, ra, dec, dec FROM source WHERE id > ?',
+                       (max_id,))
+        self.session.commit()
@@ -0,0 +1,143 @@
+from __future__ import division, print_function
+
+import numpy as np
+import pandas as pd
+
+__all__ = ['cone_search', 'box_search', 'build_spatial_index', 'source_counts']
+
+
+def _ra_ranges(ra_min, ra_max):
+    """
+    Split an ra range that may wrap through 0 into ranges in [0, 360].
+    """
+    if ra_max - ra_min >= 360:
+        return [(0.0, 360.0)]
+    ra_min, ra_max = ra_min % 360, ra_max % 360
+    if ra_min <= ra_max:
+        return [(ra_min, ra_max)]
+    return [(ra_min, 360.0), (0.0, ra_max)]
+
+
+def _box_query(session, ra_ranges, dec_min, dec_max):
+    # cross join makes sqlite drive the query from the r*tree
+    sql = ('SELECT s.* FROM source_rtree AS r CROSS JOIN source AS s '
+           'ON s.id = r.id WHERE r.ra_max >= ? AND r.ra_min <= ? '
+           'AND r.dec_max >= ? AND r.dec_min <= ? '
+           'AND s.ra BETWEEN ? AND ? AND s.dec BETWEEN ? AND ?')
+    cursor = session.connection().connection.cursor()
+    rows = []
+    for ra_min, ra_max in ra_ranges:
+        params = (ra_min, ra_max, dec_min, dec_max) * 2
+        rows.extend(cursor.execute(sql, params).fetchall())
+    columns = [d[0] for d in cursor.description]
+    return pd.DataFrame.from_records(rows, columns=columns)
+
+
+def box_search(session, ra_min, ra_max, dec_min, dec_max):
+    """
+    Find the sources within an ra, dec box using the r*tree index.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.Session
+        Database session.
+    ra_min, ra_max : float
+        Right Ascension limits in degrees. If ra_min > ra_max, the
+        box wraps through ra = 0.
+    dec_min, dec_max : float
+        Declination limits in degrees.
+
+    Returns
+    -------
+    sources : pandas.DataFrame
+        Rows of the source table within the box.
+    """
+    if ra_min > ra_max:
+        ra_max += 360
+    return _box_query(session, _ra_ranges(ra_min, ra_max), dec_min, dec_max)
+
+
+def cone_search(session, ra, dec, radius):
+    """
+    Find the sources within radius of (ra, dec) using the r*tree
+    index on the bounding box of the cone.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.Session
+        Database session.
+    ra, dec : float
+        Center of the cone in degrees.
+    radius : float
+        Radius of the cone in degrees.
+
+    Returns
+    -------
+    sources : pandas.DataFrame
+        Rows of the source table within the cone, with an extra
+        separation column (degrees), sorted by separation.
+    """
+    dec_min, dec_max = max(dec - radius, -90.0), min(dec + radius, 90.0)
+    sin_r, cos_dec = np.sin(np.deg2rad(radius)), np.cos(np.deg2rad(dec))
+    if dec_min <= -90 or dec_max >= 90 or sin_r >= cos_dec:
+        ra_ranges = [(0.0, 360.0)]
+    else:
+        # exact half-width in ra of a cone that misses the poles
+        dra = np.rad2deg(np.arcsin(sin_r / cos_dec))
+        ra_ranges = _ra_ranges(ra - dra, ra + dra)
+    sources = _box_query(session, ra_ranges, dec_min, dec_max)
+
+    ra1, dec1 = np.deg2rad(ra), np.deg2rad(dec)
+    ra2, dec2 = np.deg2rad(sources.ra.values), np.deg2rad(sources.dec.values)
+    hav = np.sin((dec2 - dec1)/2)**2 + \
+          np.cos(dec1)*np.cos(dec2)*np.sin((ra2 - ra1)/2)**2
+    sources['separation'] = np.rad2deg(2*np.arcsin(np.sqrt(hav)))
+    sources = sources[sources.separation <= radius]
+    return sources.sort_values('separation').reset_index(drop=True)
+
+
+def build_spatial_index(session):
+    """
+    Add sources that are missing from the r*tree index, e.g. in
+    databases ingested before the index existed.
+
+    Returns
+    -------
+    num_added : int
+        Number of sources added to the index.
+    """
+    cursor = session.connection().connection.cursor()
+    cursor.execute('INSERT INTO source_rtree SELECT id, ra, ra, dec, dec '
+                   'FROM source WHERE id NOT IN (SELECT id FROM source_rtree)')
+    num_added = cursor.rowcount
+    session.commit()
+    return num_added
+
+
+def source_counts(session, run_name=None):
+    """
+    Number of sources per image, e.g. to estimate the cost of each
+    tile when scheduling a new run.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.Session
+        Database session.
+    run_name : str, optional
+        Only count the sources of this run.
+
+    Returns
+    -------
+    counts : dict
+        Source count per image label.
+    """
+    sql = ('SELECT i.label, COUNT(s.id) FROM image AS i '
+           'JOIN run AS r ON i.run_id = r.id '
+           'LEFT JOIN source AS s ON s.image_id = i.id ')
+    params = ()
+    if run_name is not None:
+        sql += 'WHERE r.name = ? '
+        params = (run_name,)
+    cursor = session.connection().connection.cursor()
+    rows = cursor.execute(sql + 'GROUP BY i.id', params).fetchall()
+    return {label: count for label, count in rows}
@@ -0,0 +1,127 @@
+from __future__ import division, print_function
+
+import os
+import multiprocessing
+from queue import Empty, Full
+from astropy.io import fits
+
+__all__ = ['Writer', 'DatabaseSink']
+
+_STOP = 'STOP'
+
+
+def _consume(queue, sink_factory, sink_args, group_size):
+    """
+    Writer process main loop: block for one item, then drain up to
+    group_size items that are already queued and hand them to the sink
+    as one group (i.e., one transaction).
+    """
+    sink = sink_factory(*sink_args)
+    done = False
+    while not done:
+        group = [queue.get()]
+        while len(group) < group_size:
+            try:
+                group.append(queue.get_nowait())
+            except Empty:
+                break
+        stops = [i for i, item in enumerate(group) 
+                 if isinstance(item, str) and item == _STOP]
+        if stops:
+            group = group[:stops[0]]
+            done = True
+        if group:
+            sink.write(group)
+    sink.close()
+
+
+class Writer(object):
+    """
+    Dedicated single-writer process that consumes a bounded queue of
+    batches, so workers (or the pool's result handler) hand off their
+    output and never wait on disk I/O. The queue bound provides
+    back-pressure if the writer falls behind.
+
+    Parameters
+    ----------
+    sink_factory : callable
+        Called as sink_factory(*sink_args) in the writer process. It
+        must return an object with write(group) and close() methods,
+        where group is a list of queued items.
+    sink_args : tuple, optional
+        Arguments for sink_factory. Must be picklable.
+    maxsize : int, optional
+        Maximum number of queued items.
+    group_size : int, optional
+        Maximum number of items written per group (transaction).
+    """
+
+    def __init__(self, sink_factory, sink_args=(), maxsize=64, group_size=32):
+        self.queue = multiprocessing.Queue(maxsize)
+        self.process = multiprocessing.Process(
+            target=_consume,
+            args=(self.queue, sink_factory, sink_args, group_size))
+        self.process.daemon = True
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start(self):
+        self.process.start()
+
+    def put(self, item, poll=1.0):
+        """
+        Queue an item for writing. Blocks while the queue is full, and
+        raises RuntimeError if the writer process has died.
+        """
+        while True:
+            try:
+                self.queue.put(item, timeout=poll)
+                return
+            except Full:
+                if not self.process.is_alive():
+                    raise RuntimeError(
+                        'writer process exited with code {}'.format(
+                            self.process.exitcode))
+
+    def close(self):
+        """
+        Write everything that is queued, then stop the writer process.
+        """
+        if self.process.is_alive():
+            self.put(_STOP)
+        self.process.join()
+        if self.process.exitcode != 0:
+            raise RuntimeError('writer process exited with code {}'.format(
+                self.process.exitcode))
+
+
+class DatabaseSink(object):
+    """
+    Writer sink for the pipeline database. Each queued item is an
+    (image_label, catalog, cutouts) tuple, where cutouts is None or a
+    list of (file name, data, header) written as fits files to
+    cutout_dir. Each group is ingested with ASHDIngest.add_batch.
+    """
+
+    def __init__(self, db_fn, run_name, cutout_dir=None):
+        from .connect import connect, Session
+        from .ingest import ASHDIngest
+        connect(db_fn)
+        self.session = Session()
+        self.ingest = ASHDIngest(self.session, run_name)
+        self.cutout_dir = cutout_dir
+
+    def write(self, group):
+        self.ingest.add_batch([(label, cat) for label, cat, _ in group])
+        for _, _, cutouts in group:
+            for fn, data, header in (cutouts or []):
+                fits.writeto(os.path.join(self.cutout_dir, fn), data, header,
+                             overwrite=True)
+
+    def close(self):
+        self.session.close()
@@ -23,6 +23,7 @@ class Display(object):
         self.data_dir = data_dir
         self.butler = Butler(data_dir)
         self._ds9 = None
+        self._tile = None
 
     @property
     def ds9(self):
@@ -31,6 +32,19 @@ class Display(object):
             self._ds9 = pyds9.DS9()
         return self._ds9
 
+    def _get_tile(self, ra, dec, unit=u.deg):
+        """
+        Data and WCS of the tile nearest to (ra, dec). The last tile 
+        is kept open, since consecutive calls are usually on the 
+        same tile.
+        """
+        from astropy.wcs import WCS
+        fn = self.butler.get_image_fn(ra, dec, unit)
+        if self._tile is None or self._tile[0] != fn:
+            hdulist = fits.open(fn, memmap=True)
+            self._tile = (fn, hdulist[0].data, WCS(hdulist[0].header))
+        return self._tile[1:]
+
     def ds9_view(self, ra, dec, unit=u.deg, plot_coord=False):
         """
         Display nearest image to (ra, dec) using ds9.
@@ -65,14 +79,12 @@ class Display(object):
 	    The size (in pixels) of the cutout array along each axis.
 	    If an integer is given, will get a square. 
         """
-        hdu = self.butler.get_hdulist(ra, dec, unit)[0]
-        header = hdu.header
-        data = hdu.data
-        cutout = imutils.make_cutout(data, (ra, dec), unit=unit,    
-                                     header=header, size=size)
+        data, wcs = self._get_tile(ra, dec, unit)
+        stamps, origins = imutils.make_cutouts(data, (ra, dec), unit=unit, 
+                                               wcs=wcs, size=size)
         hdulist = fits.HDUList([fits.PrimaryHDU(
-                                data=cutout.data, 
-                                header=cutout.wcs.to_header(relax=False))])
+                                data=stamps[0], 
+                                header=imutils.cutout_header(wcs, origins[0]))])
         self.ds9.set_pyfits(hdulist)
 
         if ell_par:
@@ -120,7 +132,7 @@ class Display(object):
         """
         if pipe is None:
             assert (ra is not None) and (dec is not None)
-            data = self.butler.get_data(ra, dec, unit)
+            data, _ = self._get_tile(ra, dec, unit)
         else:
             data = pipe.original_data
 
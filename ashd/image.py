@@ -1,7 +1,9 @@
 from __future__ import division, print_function
 
+import os
 import numpy as np
 from astropy import units as u
+from astropy.io import fits
 from astropy.wcs import WCS
 #from .butler import Butler
 from .utils import ndarray_byteswap
@@ -9,35 +11,168 @@ from .utils import ndarray_byteswap
 __all__ = ['ASHDImage']
 
 class ASHDImage(object):
+    """
+    A stacked ASAS-SN image. 
 
-    def __init__(self, butler, ra=None, dec=None, unit=u.deg, image_fn=None):
-        img_kws = dict(ra=ra, dec=dec, unit=unit, image_fn=image_fn)
+    The pixels are loaded lazily from a memory-mapped fits file. If 
+    cache_dir is given, a native-endian float32 copy of the pixels is 
+    saved there as a .npy sidecar the first time the image is used, 
+    and later loads memory map that copy (copy-on-write), so there is 
+    no byteswap per run and all workers on a node share the page cache.
+    """
+
+    def __init__(self, butler, ra=None, dec=None, unit=u.deg, image_fn=None,
+                 cache_dir=None):
         self.butler = butler
-        self.header = self.butler.get_header(**img_kws)
         if image_fn is None:
             assert (ra is not None) #and (dec is not None)
             self.image_fn = self.butler.get_image_fn(ra, dec, unit)
         else:
             self.image_fn = image_fn
-        try:
-            self.zpt = self.header['ZEROPT']
-        except:
-            self.zpt = np.nan
+        self.cache_dir = cache_dir
+        # header, data, and wcs all come from a single open
+        self.hdulist = fits.open(self.image_fn, memmap=True)
+        self.header = self.hdulist[0].header
+        self.zpt = self.header.get('ZEROPT', np.nan)
         self.wcs = WCS(self.header)
-        self.data = ndarray_byteswap(self.butler.get_data(**img_kws))
+        self._tan_params = None
+        self._data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.hdulist.close()
+
+    @property
+    def cache_fn(self):
+        if self.cache_dir is None:
+            return None
+        st = os.stat(self.image_fn)
+        label = os.path.basename(self.image_fn)[:-5]
+        return os.path.join(self.cache_dir, '{}-{}-{}.npy'.format(
+            label, int(st.st_mtime), st.st_size))
+
+    @property
+    def data(self):
+        if self._data is None:
+            if self.cache_dir is None:
+                self._data = ndarray_byteswap(self.hdulist[0].data)
+            else:
+                self._data = self._load_cache()
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+
+    def _load_cache(self):
+        cache_fn = self.cache_fn
+        if not os.path.isfile(cache_fn):
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir, exist_ok=True)
+            data = self.hdulist[0].data.astype(np.float32)
+            tmp_fn = cache_fn[:-4] + '.{}.tmp.npy'.format(os.getpid())
+            np.save(tmp_fn, data)
+            os.replace(tmp_fn, cache_fn)
+        # sep needs a writable buffer, hence copy-on-write
+        return np.load(cache_fn, mmap_mode='c')
+
+    @property
+    def _tan(self):
+        # projection constants for the numpy TAN transforms
+        if self._tan_params is None:
+            w = self.wcs
+            pure_tan = (list(w.wcs.ctype) == ['RA---TAN', 'DEC--TAN'] and 
+                        not w.has_distortion and not w.wcs.get_pv() and
+                        w.wcs.lonpole == 180)
+            if not pure_tan:
+                raise ValueError('fast transforms need a plain TAN wcs '
+                                 'without distortions')
+            cd = w.pixel_scale_matrix
+            self._tan_params = (w.wcs.crpix - 1, cd, np.linalg.inv(cd), 
+                                np.deg2rad(w.wcs.crval))
+        return self._tan_params
+
+    def xy_to_radec(self, x, y, fast=False):
+        """
+        Convert pixel coordinates (0-based) to ra, dec in degrees.
+
+        Parameters
+        ----------
+        x, y : float or array-like
+            Pixel coordinates.
+        fast : bool, optional
+            If True, evaluate the gnomonic (TAN) projection directly 
+            with numpy instead of wcslib. It agrees with wcslib to 
+            better than 1e-9 arcsec on plain TAN images, and raises 
+            ValueError for any other projection or if distortions 
+            (e.g., SIP) are present.
+
+        Returns
+        -------
+        ra, dec : float or ndarray
+            Sky coordinates in degrees.
+        """
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        if not fast:
+            return self.wcs.wcs_pix2world(x, y, 0)
+        crpix, cd, _, (ra0, dec0) = self._tan
+        dx, dy = x - crpix[0], y - crpix[1]
+        xi = np.deg2rad(cd[0, 0]*dx + cd[0, 1]*dy)
+        eta = np.deg2rad(cd[1, 0]*dx + cd[1, 1]*dy)
+        denom = np.cos(dec0) - eta*np.sin(dec0)
+        ra = np.rad2deg(ra0 + np.arctan2(xi, denom)) % 360
+        dec = np.rad2deg(np.arctan2(np.sin(dec0) + eta*np.cos(dec0), 
+                                    np.hypot(xi, denom)))
+        return ra, dec
+
+    def radec_to_xy(self, ra, dec, fast=False):
+        """
+        Convert ra, dec in degrees to pixel coordinates (0-based).
+
+        Parameters
+        ----------
+        ra, dec : float or array-like
+            Sky coordinates in degrees.
+        fast : bool, optional
+            If True, evaluate the gnomonic (TAN) projection directly 
+            with numpy (see xy_to_radec).
+
+        Returns
+        -------
+        x, y : float or ndarray
+            Pixel coordinates.
+        """
+        ra, dec = np.asarray(ra, dtype=float), np.asarray(dec, dtype=float)
+        if not fast:
+            return self.wcs.wcs_world2pix(ra, dec, 0)
+        crpix, _, cd_inv, (ra0, dec0) = self._tan
+        ra, dec = np.deg2rad(ra), np.deg2rad(dec)
+        cos_c = np.sin(dec0)*np.sin(dec) + \
+                np.cos(dec0)*np.cos(dec)*np.cos(ra - ra0)
+        xi = np.rad2deg(np.cos(dec)*np.sin(ra - ra0) / cos_c)
+        eta = np.rad2deg((np.cos(dec0)*np.sin(dec) - 
+                          np.sin(dec0)*np.cos(dec)*np.cos(ra - ra0)) / cos_c)
+        x = cd_inv[0, 0]*xi + cd_inv[0, 1]*eta + crpix[0]
+        y = cd_inv[1, 0]*xi + cd_inv[1, 1]*eta + crpix[1]
+        return x, y
 
     def sky_to_pix(self, sky_coord):
-        if type(sky_coord[0]) not in (list, np.ndarray):
-            ra, dec = sky_coord
-            pix_coord = self.wcs.wcs_world2pix([[ra, dec]], 0)[0]
-        else:
-            pix_coord = self.wcs.wcs_world2pix(sky_coord, 0)
-        return pix_coord
+        """
+        Convert (ra, dec) or an (N, 2) array of them to pixels.
+        """
+        sky_coord = np.asarray(sky_coord, dtype=float)
+        return np.stack(self.radec_to_xy(sky_coord[..., 0], 
+                                         sky_coord[..., 1]), axis=-1)
 
     def pix_to_sky(self, pix_coord):
-        if type(pix_coord[0]) not in (list, np.ndarray):
-            x, y= pix_coord
-            sky_coord = self.wcs.wcs_pix2world([[x, y]], 0)[0]
-        else:
-            sky_coord = self.wcs.wcs_pix2world(pix_coord, 0)
-        return sky_coord
+        """
+        Convert (x, y) or an (N, 2) array of them to ra, dec.
+        """
+        pix_coord = np.asarray(pix_coord, dtype=float)
+        return np.stack(self.xy_to_radec(pix_coord[..., 0], 
+                                         pix_coord[..., 1]), axis=-1)
@@ -1,12 +1,40 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
+import functools
+import inspect
 import numpy as np
 import scipy.ndimage as ndi
 
-__all__ = ['rmedian', 'make_cutout', 'exp_kern']
+__all__ = ['rmedian', 'make_cutout', 'make_cutouts', 'cutout_header', 
+           'exp_kern', 'gauss_kern', 'kernel_array']
 
+# memoized kernels and footprints, keyed by (function, parameters)
+_kernel_registry = {}
 
+
+def _memoize(func):
+    """
+    Cache the array returned by func for each set of arguments 
+    (defaults included) and hand out the same read-only array, 
+    so repeated setup is a dictionary lookup.
+    """
+    sig = inspect.signature(func)
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        bound = sig.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = (func.__name__, tuple(bound.arguments.items()))
+        arr = _kernel_registry.get(key)
+        if arr is None:
+            arr = func(*args, **kwargs)
+            arr.setflags(write=False)
+            _kernel_registry[key] = arr
+        return arr
+    return wrapper
+
+
+@_memoize
 def _ring(r_inner, r_outer, dtype=np.int, invert=False):
     """
     Generate a 2D ring footprint.
@@ -38,7 +66,180 @@ def _ring(r_inner, r_outer, dtype=np.int, invert=False):
     return fp
 
 
-def rmedian(image, r_inner, r_outer, **kwargs):
+def _max_binning(r_inner, r_outer, **kwargs):
+    """
+    Largest rmedian binning whose scaled ring is not empty, or 0 if 
+    the ring is empty without binning.
+    """
+    for binning in range(max(int(r_outer), 1), 0, -1):
+        if _ring(r_inner/binning, r_outer/binning, **kwargs).any():
+            return binning
+    return 0
+
+
+def _ring_offsets(fp):
+    """
+    Offsets of the footprint pixels from its center, plus the 
+    pixels that leave and enter the footprint when it moves one 
+    pixel to the right.
+    """
+    r = fp.shape[0] // 2
+    fp = fp.astype(bool)
+    dy, dx = np.nonzero(fp)
+    left = np.zeros_like(fp)
+    left[:, 1:] = fp[:, :-1]
+    right = np.zeros_like(fp)
+    right[:, :-1] = fp[:, 1:]
+    rem_dy, rem_dx = np.nonzero(fp & ~left)
+    add_dy, add_dx = np.nonzero(fp & ~right)
+    offsets = [dy, dx, rem_dy, rem_dx, add_dy, add_dx]
+    return [(o - r).astype(np.int64) for o in offsets]
+
+
+def _hist_median_rows(padded, bits, q, nbins, r, fp_dy, fp_dx, 
+                      rem_dy, rem_dx, add_dy, add_dx):
+    """
+    Sliding-histogram median (Huang et al. 1979) over the quantized
+    image q, moving the footprint along each row. Only the pixels 
+    that enter or leave the footprint update the histogram, and the
+    exact median is recovered from the few footprint pixels that 
+    share its histogram bin. The (wrapping) integer sum of the raw
+    bits in each bin gives the median directly when it is alone in 
+    its bin. Compiled with numba by _hist_kernel.
+    """
+    ny = padded.shape[0] - 2*r
+    nx = padded.shape[1] - 2*r
+    out = np.empty((ny, nx), dtype=padded.dtype)
+    n = fp_dy.size
+    k = n // 2
+    hist = np.zeros(nbins, dtype=np.int64)
+    bin_bits = np.zeros(nbins, dtype=np.int64)
+    buf = np.empty(n, dtype=padded.dtype)
+    one = np.empty(1, dtype=bits.dtype)
+    for y in range(ny):
+        yc = y + r
+        hist[:] = 0
+        bin_bits[:] = 0
+        for j in range(n):
+            b = q[yc + fp_dy[j], r + fp_dx[j]]
+            hist[b] += 1
+            bin_bits[b] += bits[yc + fp_dy[j], r + fp_dx[j]]
+        m = 0
+        lt = 0
+        for x in range(nx):
+            xc = x + r
+            if x > 0:
+                for j in range(rem_dy.size):
+                    b = q[yc + rem_dy[j], xc - 1 + rem_dx[j]]
+                    hist[b] -= 1
+                    bin_bits[b] -= bits[yc + rem_dy[j], xc - 1 + rem_dx[j]]
+                    if b < m:
+                        lt -= 1
+                for j in range(add_dy.size):
+                    b = q[yc + add_dy[j], xc + add_dx[j]]
+                    hist[b] += 1
+                    bin_bits[b] += bits[yc + add_dy[j], xc + add_dx[j]]
+                    if b < m:
+                        lt += 1
+            while lt > k:
+                m -= 1
+                lt -= hist[m]
+            while lt + hist[m] <= k:
+                lt += hist[m]
+                m += 1
+            if hist[m] == 1:
+                one[0] = bin_bits[m]
+                out[y, x] = one.view(padded.dtype)[0]
+                continue
+            # insertion sort of the footprint values in the median bin
+            cnt = 0
+            for j in range(n):
+                yy = yc + fp_dy[j]
+                xx = xc + fp_dx[j]
+                if q[yy, xx] == m:
+                    val = padded[yy, xx]
+                    i = cnt
+                    while i > 0 and buf[i - 1] > val:
+                        buf[i] = buf[i - 1]
+                        i -= 1
+                    buf[i] = val
+                    cnt += 1
+            out[y, x] = buf[k - lt]
+    return out
+
+
+_hist_kernel_cache = []
+
+def _hist_kernel():
+    if not _hist_kernel_cache:
+        try:
+            import numba
+        except ImportError:
+            raise ImportError("rmedian method='histogram' requires numba")
+        _hist_kernel_cache.append(
+            numba.njit(nogil=True, cache=True)(_hist_median_rows))
+    return _hist_kernel_cache[0]
+
+
+def _quantize(data, nbins=1024, sample_size=100000):
+    """
+    Map data to the indices of nbins equal-count bins, so that the
+    median walk and the exact recovery of _hist_median_rows both 
+    only touch a handful of pixels.
+    """
+    step = max(1, data.size // sample_size)
+    sample = data.ravel()[::step]
+    edges = np.quantile(sample, np.linspace(0, 1, nbins + 1)[1:-1])
+    return np.searchsorted(edges, data, side='right').astype(np.int32)
+
+
+def _strip_apply(func, ny, n_threads):
+    """
+    Run func(y0, y1) over row strips [y0, y1) of an ny-row image in a 
+    pool of threads and stack the results. func must return the 
+    filtered rows y0 to y1, computed from a padded strip with a halo 
+    of real pixels, so the result is identical to the serial one.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    bounds = np.linspace(0, ny, min(n_threads, ny) + 1).astype(int)
+    with ThreadPoolExecutor(n_threads) as executor:
+        strips = executor.map(func, bounds[:-1], bounds[1:])
+        return np.concatenate(list(strips))
+
+
+def _bin_image(image, binning):
+    """
+    Block-average image by binning, padding the edges (by reflection) 
+    to a multiple of binning.
+    """
+    ny, nx = image.shape
+    pad_y, pad_x = -ny % binning, -nx % binning
+    if pad_y or pad_x:
+        image = np.pad(image, ((0, pad_y), (0, pad_x)), mode='symmetric')
+    shape = (image.shape[0]//binning, binning, image.shape[1]//binning, binning)
+    return image.reshape(shape).mean(axis=(1, 3))
+
+
+def _upsample(coarse, shape, binning):
+    """
+    Bilinearly interpolate a binned image back to shape, aligning the 
+    bin centers with the native pixel centers.
+    """
+    out = coarse
+    for axis, size in enumerate(shape):
+        n = coarse.shape[axis]
+        pos = np.clip((np.arange(size) + 0.5)/binning - 0.5, 0, n - 1)
+        i0 = np.floor(pos).astype(int)
+        i1 = np.minimum(i0 + 1, n - 1)
+        w = pos - i0
+        w = w[:, None] if axis == 0 else w
+        out = np.take(out, i0, axis=axis)*(1 - w) + \
+              np.take(out, i1, axis=axis)*w
+    return out
+
+
+def rmedian(image, r_inner, r_outer, method='scipy', nbins=1024, 
+            n_threads=1, binning=1, **kwargs):
     """
     Median filter image with a ring footprint. This
     function produces results similar to the IRAF 
@@ -51,14 +252,82 @@ def rmedian(image, r_inner, r_outer, **kwargs):
         The inner radius of the ring in pixels.
     r_outer : int
         The outer radius of the ring in pixels.
+    method : str, optional
+        'scipy' uses scipy.ndimage.median_filter. 'histogram'
+        uses a sliding-histogram ring median (requires numba), 
+        which gives identical results. It cannot rank NaNs or 
+        infs, so images that have them fall back to 'scipy'.
+    nbins : int, optional
+        Number of histogram bins for method='histogram'.
+    n_threads : int, optional
+        If > 1, filter row strips in a pool of this many threads.
+        Both methods release the GIL and the output is identical 
+        to the serial result.
+    binning : int, optional
+        If > 1, compute an approximate ring median: block-average the 
+        image by this factor, filter it with radii scaled by 1/binning,
+        and bilinearly upsample the result. Every value of the 
+        approximation and of the exact filter is a pixel value or 
+        block average from within r_outer + 1.5*binning pixels 
+        (in x and y), so the error at each pixel is bounded by the 
+        range (max - min) of the image in that box. On sky-dominated 
+        regions it is a small fraction of the sky noise; see 
+        scripts/bench-rmedian.py. The cost drops by ~binning**2.
+        The scaled ring must contain at least one pixel, which 
+        limits binning to at most r_outer (e.g., 8 for radii 5 and 
+        8); larger values raise a ValueError.
     Returns
     -------
     filtered_data : ndarray
         Ring filtered image.
     """
+    if binning > 1:
+        if not _ring(r_inner/binning, r_outer/binning, **kwargs).any():
+            raise ValueError(
+                'binning={} leaves no pixels in the ring ({}, {}); the '
+                'largest binning for these radii is {}'.format(
+                    binning, r_inner, r_outer,
+                    _max_binning(r_inner, r_outer, **kwargs)))
+        coarse = rmedian(_bin_image(image, binning), r_inner/binning, 
+                         r_outer/binning, method=method, nbins=nbins, 
+                         n_threads=n_threads, **kwargs)
+        filtered_data = _upsample(coarse, image.shape, binning)
+        return filtered_data.astype(image.dtype, copy=False)
+
+    if method == 'histogram' and not np.isfinite(image).all():
+        method = 'scipy'
     fp = _ring(r_inner, r_outer, **kwargs)
-    filtered_data = ndi.median_filter(image, footprint=fp)
-    return filtered_data
+    if method == 'scipy' and n_threads == 1:
+        return ndi.median_filter(image, footprint=fp)
+
+    halo = fp.shape[0] // 2
+    ny, nx = image.shape
+    if method == 'histogram':
+        from .utils import ndarray_byteswap
+        image = np.ascontiguousarray(ndarray_byteswap(image))
+    # 'symmetric' padding is scipy.ndimage's 'reflect' mode
+    padded = np.pad(image, halo, mode='symmetric')
+
+    if method == 'scipy':
+        def func(y0, y1):
+            strip = padded[y0:y1 + 2*halo]
+            filtered = ndi.median_filter(strip, footprint=fp)
+            return filtered[halo:halo + y1 - y0, halo:halo + nx]
+    elif method == 'histogram':
+        kernel = _hist_kernel()
+        offsets = _ring_offsets(fp)
+        bits = padded.view('i{}'.format(padded.dtype.itemsize))
+        q = _quantize(padded, nbins)
+        def func(y0, y1):
+            rows = slice(y0, y1 + 2*halo)
+            return kernel(padded[rows], bits[rows], q[rows], nbins, 
+                          halo, *offsets)
+    else:
+        raise ValueError('unknown rmedian method: {}'.format(method))
+
+    if n_threads == 1:
+        return func(0, ny)
+    return _strip_apply(func, ny, n_threads)
 
 
 def make_cutout(data, coord, unit='deg', header=None, 
@@ -110,6 +379,80 @@ def make_cutout(data, coord, unit='deg', header=None,
         fits.writeto(write, cutout.data, header, clobber=True)
 
 
+
+def make_cutouts(data, coords, unit='deg', header=None, wcs=None,
+                 size=301, fill_value=np.nan):
+    """
+    Generate postage stamps of many positions on one image at once.
+    All positions are converted to pixels with a single WCS call, and 
+    the stamps are placed as in make_cutout (Cutout2D), except that 
+    stamps that fall off the image are padded with fill_value, so 
+    they all have the same shape.
+
+    Parameters
+    ----------
+    data : 2D ndarray
+        The data from the fits file.
+    coords : tuple of array-like
+        The central coordinates of the cutouts. If header and wcs 
+        are None, then unit is pixels (x, y), else it is ra and dec.
+    unit : astropy.units.Unit or str, optional
+        Unit of coordinates
+    header : Fits header, optional
+        The fits header, which must have WCS info.
+    wcs : astropy.wcs.WCS, optional
+        The image WCS. Used instead of header if given.
+    size : int, array-like, optional
+        The size (ny, nx) of the cutouts. If an integer is given, 
+        will get squares.
+    fill_value : float, optional
+        Value of the stamp pixels outside the image.
+
+    Returns
+    -------
+    stamps : 3D ndarray
+        The cutouts, stacked along the first axis.
+    origins : 2D ndarray
+        The (x, y) pixel of data at the lower-left corner of each 
+        stamp, which may be negative.
+    """
+    ny, nx = np.broadcast_to(size, 2).astype(int)
+    if header is not None and wcs is None:
+        from astropy.wcs import WCS
+        wcs = WCS(header)
+    if wcs is None:
+        x, y = (np.atleast_1d(np.asarray(c, dtype=float)) for c in coords)
+    else:
+        from astropy.coordinates import SkyCoord
+        sky = SkyCoord(np.atleast_1d(coords[0]), np.atleast_1d(coords[1]),
+                       frame='icrs', unit=unit)
+        x, y = wcs.all_world2pix(sky.ra.deg, sky.dec.deg, 0)
+
+    # same placement as astropy.nddata.utils.overlap_slices
+    x0 = np.ceil(x - nx / 2.0).astype(int)
+    y0 = np.ceil(y - ny / 2.0).astype(int)
+    rows = y0[:, None] + np.arange(ny)
+    cols = x0[:, None] + np.arange(nx)
+    valid = (rows >= 0) & (rows < data.shape[0])
+    valid = valid[:, :, None] & ((cols >= 0) & (cols < data.shape[1]))[:, None]
+    stamps = data[np.clip(rows, 0, data.shape[0] - 1)[:, :, None],
+                  np.clip(cols, 0, data.shape[1] - 1)[:, None, :]]
+    dtype = np.result_type(data.dtype.newbyteorder('='), fill_value)
+    stamps = np.where(valid, stamps, fill_value).astype(dtype, copy=False)
+    return stamps, np.column_stack([x0, y0])
+
+
+def cutout_header(wcs, origin):
+    """
+    WCS header of a cutout whose lower-left pixel is at origin (x, y) 
+    of the image with the given WCS.
+    """
+    wcs = wcs.deepcopy()
+    wcs.wcs.crpix = wcs.wcs.crpix - np.asarray(origin)
+    return wcs.to_header(relax=False)
+
+
+@_memoize
 def exp_kern(alpha, size, norm_array=False, mode='center', factor=10):
     """
     Generate 2D, radially symmetric exponential kernal for sextractor. 
@@ -131,7 +474,7 @@ def exp_kern(alpha, size, norm_array=False, mode='center', factor=10):
     Returns
     -------
     kern : 2D ndarray, if (return_fn=False)
-        The convolution kernel. 
+        The convolution kernel (read-only and shared between calls). 
     kern, fn, comment : ndarray, string, string (if return_fn=True)
         The kernel, file name, and the comment
         for the file.
@@ -152,3 +495,52 @@ def exp_kern(alpha, size, norm_array=False, mode='center', factor=10):
         kern /= kern.sum()
     
     return kern
+
+
+@_memoize
+def gauss_kern(fwhm, size, dtype=np.float64):
+    """
+    Generate a normalized 2D Gaussian kernel for sep. 
+    Parameters
+    ----------
+    fwhm : float
+        The FWHM of the Gaussian in pixels.
+    size : odd int
+        Number of pixel in x & y directions.
+    dtype : data type, optional
+        The data type of the output array
+    Returns
+    -------
+    kern : 2D ndarray
+        The convolution kernel (read-only and shared between calls). 
+    """
+    from astropy.stats import gaussian_fwhm_to_sigma
+    from astropy.convolution import Gaussian2DKernel
+    sigma = gaussian_fwhm_to_sigma*fwhm
+    kern = Gaussian2DKernel(sigma, x_size=size, y_size=size).array
+    return (kern / kern.sum()).astype(dtype)
+
+
+def kernel_array(kernel):
+    """
+    Get the normalized array of a convolution kernel. 
+    Parameters
+    ----------
+    kernel : astropy.convolution.Kernel2D, 2D ndarray, or None
+        The kernel. 
+    Returns
+    -------
+    kern : 2D ndarray or None
+        The normalized kernel array (read-only and shared between 
+        calls with the same kernel values), or None if kernel is None.
+    """
+    if kernel is None:
+        return None
+    arr = np.asarray(getattr(kernel, 'array', kernel))
+    key = ('kernel_array', arr.shape, arr.dtype.str, arr.tobytes())
+    kern = _kernel_registry.get(key)
+    if kern is None:
+        kern = arr / arr.sum()
+        kern.setflags(write=False)
+        _kernel_registry[key] = kern
+    return kern
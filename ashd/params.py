@@ -1,5 +1,4 @@
-from astropy.stats import gaussian_fwhm_to_sigma
-from astropy.convolution import Gaussian2DKernel
+from . import imutils
 
 class PipeParams(object):
     """
@@ -10,6 +9,12 @@ class PipeParams(object):
 
         self.log_level = 'info'
         self.data_dir = '/Users/protostar/Dropbox/projects/data/asas-sn-images'
+        # if not None, cache native-endian pixels here (see ASHDImage)
+        self.cache_dir = None
+        # if not None, cache the ring-filtered image and background 
+        # here, so reruns with new sep.extract parameters skip them 
+        # (see StageCache)
+        self.stage_cache_dir = None
         
         # sep.Background parameters
         self.bw = 64
@@ -28,16 +33,39 @@ class PipeParams(object):
         self.segmentation_map = False
         self.filter_type = 'conv'
 
-        # smoothing kernel
-        size = 31
+        # smoothing kernel: a Gaussian with the following fwhm and size 
+        # (from the kernel registry), unless kernel is set explicitly
+        self.kernel_size = 31
         self.gauss_fwhm = 5.0
-        sigma = gaussian_fwhm_to_sigma*self.gauss_fwhm
-        self.kernel = Gaussian2DKernel(sigma, x_size=size, y_size=size)
+        self._kernel = 'gauss'
 
         # ring filter parameters
         self.do_ring_filter = True
         self.r_inner = 5.0
         self.r_outer = 8.0
+        self.ring_method = 'scipy'
+        self.ring_threads = 1
+        # > 1 for the approximate, binned ring filter (see rmedian)
+        self.ring_binning = 1
+
+    @property
+    def kernel(self):
+        if isinstance(self._kernel, str) and self._kernel == 'gauss':
+            return imutils.gauss_kern(self.gauss_fwhm, self.kernel_size)
+        return self._kernel
+
+    @kernel.setter
+    def kernel(self, kernel):
+        self._kernel = kernel
+
+    @property
+    def ring_kws(self):
+        # what the ring-filtered image depends on; the exact ring 
+        # methods and the number of threads give identical results
+        if not self.do_ring_filter:
+            return dict(do_ring_filter=False)
+        return dict(do_ring_filter=True, r_inner=self.r_inner, 
+                    r_outer=self.r_outer, ring_binning=self.ring_binning)
 
     @property
     def sep_back_kws(self):
@@ -48,11 +76,7 @@ class PipeParams(object):
         
     @property
     def sep_extract_kws(self):
-        if self.kernel is not None:
-            self.kernel.normalize()
-            kern_arr = self.kernel.array
-        else:
-            kern_arr = None
+        kern_arr = imutils.kernel_array(self.kernel)
         kws = dict(
            thresh=self.thresh, minarea=self.minarea, filter_kernel=kern_arr, 
            filter_type=self.filter_type, deblend_nthresh=self.deblend_nthresh, 
@@ -7,17 +7,78 @@ import pandas as pd
 from astropy import units as u
 import sep
 from .imutils import rmedian
+from .butler import Butler
 from .image import ASHDImage
 from .params import PipeParams
+from .stagecache import StageCache
 from . import utils
 from . import database
 
 __all__ = ['ASHDPipe']
 
+
+# The detection stages, shared by ASHDPipe.detect and sweep. The ring 
+# and background stages return (products, hit), where hit is True if 
+# the products came from the StageCache of params.stage_cache_dir.
+
+def stage_kws(stage, params):
+    """
+    The parameters that a cached stage and the stages before it 
+    depend on.
+    """
+    if stage == 'ring':
+        return params.ring_kws
+    elif stage == 'background':
+        return dict(params.ring_kws, **params.sep_back_kws)
+    raise ValueError('unknown stage: {}'.format(stage))
+
+
+def _cached(image, stage, params, compute):
+    if params.stage_cache_dir is None:
+        return compute(), False
+    cache = StageCache(params.stage_cache_dir)
+    return cache.cached(image.image_fn, image.data.dtype, stage, 
+                        stage_kws(stage, params), compute)
+
+
+def ring_stage(image, data, params):
+    """
+    Ring-filtered data of image, or data itself if params turn the 
+    ring filter off.
+    """
+    if not params.do_ring_filter:
+        return data, False
+    def compute():
+        return dict(image=rmedian(
+            data, params.r_inner, params.r_outer, method=params.ring_method,
+            n_threads=params.ring_threads, binning=params.ring_binning))
+    products, hit = _cached(image, 'ring', params, compute)
+    return products['image'], hit
+
+
+def background_stage(image, data, params):
+    """
+    sep background map and global rms of the (ring-filtered) data.
+    """
+    def compute():
+        bkg = sep.Background(data, **params.sep_back_kws)
+        return dict(back=bkg.back(), globalrms=np.array(bkg.globalrms))
+    return _cached(image, 'background', params, compute)
+
+
+def extract_stage(data_sub, bkg, params):
+    """
+    sep sources (and segmentation map, if params ask for it) of the 
+    background-subtracted data.
+    """
+    return sep.extract(data_sub, err=float(bkg['globalrms']), 
+                       **params.sep_extract_kws)
+
+
 class ASHDPipe(object):
     
     def __init__(self, ra=None, dec=None, unit=u.deg, image_fn=None, 
-                 params=None, run_name='dev-run'):
+                 params=None, run_name='dev-run', butler=None):
         self.run_name = run_name
         self.params = params if params else PipeParams()
         self.logger = utils.get_logger(level=self.params.log_level)
@@ -26,11 +87,13 @@ class ASHDPipe(object):
                              format(ra, dec)) 
         else:
             self.logger.info('fetching {}'.format(image_fn))
+        self.butler = butler if butler else Butler(self.params.data_dir)
         img_kw = dict(ra=ra, dec=dec, unit=unit, image_fn=image_fn, 
-                      data_dir=params.data_dir)
-        self.image = ASHDImage(**img_kw)
+                      cache_dir=self.params.cache_dir)
+        self.image = ASHDImage(self.butler, **img_kw)
         self.image_label = self.image.image_fn.split('/')[-1][:-5]
-        self.data = self.image.data.copy()
+        # every stage returns a new array, so no copy is needed
+        self.data = self.image.data
         self.coord = [ra, dec]
         self._display = None
 
@@ -45,29 +108,40 @@ class ASHDPipe(object):
             self._display = Display()
         return self._display
 
-    def ring_filter(self, r_inner=3.0, r_outer=4.0):
+    def ring_filter(self, r_inner=3.0, r_outer=4.0, method='scipy', 
+                    n_threads=1, binning=1):
         self.logger.info(
             'smoothing image with ring filter with r_in = {} and r_out = {}'.\
             format(r_inner, r_outer))
-        self.data = rmedian(self.data, r_inner, r_outer)
+        self.data = rmedian(self.data, r_inner, r_outer, method=method, 
+                            n_threads=n_threads, binning=binning)
 
     def detect(self):
-        if self.params.do_ring_filter:
-            self.ring_filter(self.params.r_inner, self.params.r_outer)
-        self.logger.info('measuring and subtracting background')
-        bkg = sep.Background(self.data, **self.params.sep_back_kws)
-        self.data_sub = self.data - bkg
+        p = self.params
+        if p.do_ring_filter:
+            self.logger.info(
+                'smoothing image with ring filter with r_in = {} and '
+                'r_out = {}'.format(p.r_inner, p.r_outer))
+        self.data, hit = ring_stage(self.image, self.data, p)
+        if hit:
+            self.logger.info('using cached ring products')
+        self.logger.info('measuring background')
+        bkg, hit = background_stage(self.image, self.data, p)
+        if hit:
+            self.logger.info('using cached background products')
+        self.logger.info('subtracting background')
+        self.data_sub = self.data - bkg['back']
         self.logger.info('detecting sources')
-        result =  sep.extract(
-            self.data_sub, err=bkg.globalrms, **self.params.sep_extract_kws)
+        result = extract_stage(self.data_sub, bkg, p)
         if self.params.segmentation_map:
             self.sources, self.seg_map = result
         else:
             self.sources = result
         self.sources = pd.DataFrame(self.sources)
-        sky_coords = self.image.pix_to_sky(self.sources[['x', 'y']].values)
-        self.sources['ra'] = sky_coords[:, 0]
-        self.sources['dec'] = sky_coords[:, 1]
+        ra, dec = self.image.xy_to_radec(self.sources.x.values, 
+                                         self.sources.y.values)
+        self.sources['ra'] = ra
+        self.sources['dec'] = dec
         
     def calc_auto_params(self):
         cols = ['x', 'y', 'a', 'b', 'theta']
@@ -108,3 +182,12 @@ class ASHDPipe(object):
         self.logger.info('writing catalog to database')
         db_ingest = database.ASHDIngest(session, self.run_name)
         db_ingest.add_all(self.image_label, self.sources)
+
+    def write_to_parquet(self, path='', condition=None):
+        cat_dir = os.path.join(path, self.run_name)
+        if condition is not None:
+            sources = self.sources[condition].copy()
+        else:
+            sources = self.sources
+        self.logger.info('writing catalog to '+cat_dir)
+        database.write_catalog(sources, cat_dir, self.image_label)
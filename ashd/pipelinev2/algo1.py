@@ -1,22 +1,27 @@
 from global_vals import *
-from common import cut_corners
+from common import corner_mask, top_k
 import numpy as np
 
 # this algorithm revolves around taking the largest objects and measuring their flux
 # those with a lower average flux while still being large are our best LSB candidates
 def find_lbg(objects, data, **kwargs):
-    if not kwargs.get('corners', False): objects = np.array(list(cut_corners(objects, thresh=500)))
+    for i in select_lbg(objects, data, **kwargs):
+        yield objects[i]
+
+# the same selection with array operations; returns the indices of the candidates in `objects`
+def select_lbg(objects, data, **kwargs):
+    idx = np.arange(objects.size)
+    if not kwargs.get('corners', False): idx = idx[corner_mask(objects, thresh=500)]
+    if idx.size == 0: return idx
     percentiles = kwargs.get('percentiles', [10,99])
 
-    avgsb = np.mean(objects['cflux'] / objects['npix'])
+    sb = objects['cflux'][idx] / objects['npix'][idx]
+    avgsb = np.mean(sb)
 
-    brightsort = sorted(objects, key=lambda x: x['cflux'] / x['npix']); cnt = len(brightsort)
-    largest = sorted(brightsort[cnt * percentiles[0] // 100 : cnt * percentiles[1] // 100],
-                    key=lambda x: x['npix'], reverse=True)[0:kwargs.get('maxtries', MAX_TRIES)]
-    found = 0; maxfindings = kwargs.get('maxfindings', MAX_FINDINGS)
-    for obj in largest:
-        sb = obj['cflux'] / obj['npix']
-        if sb < avgsb:
-            found += 1
-            yield obj
-            if found > maxfindings: break
\ No newline at end of file
+    # stable sorts, so ties come out in the same order as with `sorted`
+    brightsort = np.argsort(sb, kind='stable'); cnt = idx.size
+    middle = brightsort[cnt * percentiles[0] // 100 : cnt * percentiles[1] // 100]
+    largest = middle[top_k(objects['npix'][idx[middle]], kwargs.get('maxtries', MAX_TRIES))]
+    # up to `maxfindings` + 1 candidates, as the loop this replaces stopped at found > maxfindings
+    maxfindings = kwargs.get('maxfindings', MAX_FINDINGS)
+    return idx[largest[sb[largest] < avgsb][:maxfindings + 1]]
@@ -1,22 +1,30 @@
 from global_vals import *
-from common import cut_corners
+from common import corner_mask, top_k
 import numpy as np
 from scipy import signal
 
 # this algo revolves around finding objects wherein some form gradient/sersic can be found
 # basically, how do you avoid star clusters
 def find_lbg(objects, data, **kwargs):
+    for i in select_lbg(objects, data, **kwargs):
+        yield objects[i]
+
+# the same selection with array operations; returns the indices of the candidates in `objects`
+def select_lbg(objects, data, **kwargs):
     maxtries = kwargs.get('maxtries', objects.size)
-    if not kwargs.get('corners', False): objects = np.array(list(cut_corners(objects, thresh=500)))
-    
-    largest = sorted(objects, key = lambda x: x['npix'], reverse=True)[0:maxtries]
-    found = 0; maxfindings = kwargs.get('maxfindings', MAX_FINDINGS)
-    for obj in largest:
-        if is_lbg(obj, data):
-            found += 1
-            yield obj
-            if found > maxfindings: break
-    #return None
+    idx = np.arange(objects.size)
+    if not kwargs.get('corners', False): idx = idx[corner_mask(objects, thresh=500)]
+
+    largest = idx[top_k(objects['npix'][idx], maxtries)]
+    # the profiles are evaluated in blocks of `batch_size`, largest first, until more than
+    # `maxfindings` candidates are found
+    found = []; maxfindings = kwargs.get('maxfindings', MAX_FINDINGS)
+    batch_size = kwargs.get('batch_size', 256)
+    for start in range(0, largest.size, batch_size):
+        block = largest[start:start + batch_size]
+        found.extend(block[is_lbg_batch(objects[block], data)])
+        if len(found) > maxfindings: break
+    return np.array(found[:maxfindings + 1], dtype=np.intp)
 
 def is_lbg(obj, data, default=[30, 2030], extend=30, sigma=1000):
     _, smoothed = datavals(obj, data, default, extend, sigma)
@@ -38,4 +46,86 @@ def datavals(obj, data, default, extend, sigma):
     #ash = np.arcsinh(subset)
     smoothed = signal.cspline1d(subset, sigma)
     
-    return (subset, smoothed)
\ No newline at end of file
+    return (subset, smoothed)
+
+# batched `is_lbg`: evaluates the row profiles of many objects at once and returns a boolean mask
+def is_lbg_batch(objects, data, default=[30, 2030], extend=30, sigma=1000):
+    starts = np.maximum(objects['xmin'].astype(int) - extend, default[0])
+    stops = np.minimum(objects['xmax'].astype(int) + extend, default[1])
+    lengths = stops - starts
+    if objects.size == 0: return np.zeros(0, dtype=bool)
+
+    # gather every profile into one zero-padded 2D array
+    cols = starts[:, None] + np.arange(lengths.max())
+    valid = cols < stops[:, None]
+    rows = data[objects['y'].astype(int)[:, None], np.where(valid, cols, 0)]
+    smoothed = cspline1d_rows(np.where(valid, rows, 0).astype(data.dtype), lengths, sigma)
+
+    # the statistics go by profile length, so each reduction is over a contiguous block
+    out = np.zeros(objects.size, dtype=bool)
+    for n in np.unique(lengths):
+        sel = np.flatnonzero(lengths == n)
+        s = smoothed[sel, :n]
+        m = np.mean(s, axis=1)
+        maxval = m + np.std(s, axis=1)
+        p25 = s[:, n // 4] - s[:, (n // 4) - 1]
+        p75 = s[:, n * 3 // 4] - s[:, (n * 3 // 4) - 1]
+        out[sel] = (s[:, n // 2] > maxval) & (p25 > 0) & (p75 < m)
+    return out
+
+# `signal.cspline1d(row, lamb)` (lamb != 0) for every row of a zero-padded 2D array at once;
+# row i has `lengths[i]` samples. The recursive filters run along the columns, with the rows
+# left-aligned for the forward pass and reversed for the backward pass, and keep scipy's
+# arithmetic (float64 math, stored in the data type) so the results are identical
+def cspline1d_rows(rows, lengths, lamb):
+    rho, omega = _coeff_smooth(lamb)
+    cs = 1 - 2 * rho * np.cos(omega) + rho * rho
+    a = 2 * rho * np.cos(omega); b = rho * rho
+    nrows, kmax = rows.shape
+    k = np.arange(kmax)
+    hc1 = _hc(k + 1, cs, rho, omega); hc2 = _hc(k + 2, cs, rho, omega)
+    hs0 = _hs(k, cs, rho, omega) + _hs(k + 1, cs, rho, omega)
+    hs1 = _hs(k - 1, cs, rho, omega) + _hs(k + 2, cs, rho, omega)
+    hc0 = _hc(0, cs, rho, omega); hc01 = _hc(1, cs, rho, omega)
+    rev = np.clip(lengths[:, None] - 1 - k, 0, None)
+    reversed_rows = np.take_along_axis(rows, rev, axis=1)
+
+    yp = np.zeros(rows.shape, rows.dtype.char)
+    y = np.zeros(rows.shape, rows.dtype.char)
+    # the initial conditions are sums over each whole row
+    for i, n in enumerate(lengths):
+        s = rows[i, :n]; r = reversed_rows[i, :n]
+        yp[i, 0] = hc0 * s[0] + np.add.reduce(hc1[:n] * s)
+        yp[i, 1] = hc0 * s[0] + hc01 * s[1] + np.add.reduce(hc2[:n] * s)
+        y[i, 0] = np.add.reduce(hs0[:n] * r)
+        y[i, 1] = np.add.reduce(hs1[:n] * r)
+
+    f8 = np.float64
+    for n in range(2, kmax):
+        yp[:, n] = cs * rows[:, n].astype(f8) + a * yp[:, n - 1].astype(f8) - b * yp[:, n - 2].astype(f8)
+    yp_rev = np.take_along_axis(yp, rev, axis=1)
+    for n in range(2, kmax):
+        y[:, n] = cs * yp_rev[:, n].astype(f8) + a * y[:, n - 1].astype(f8) - b * y[:, n - 2].astype(f8)
+    # back to the original sample order, zero past the end of each row
+    out = np.take_along_axis(y, rev, axis=1)
+    out[k >= lengths[:, None]] = 0
+    return out
+
+# the smoothing spline filter coefficients, as in scipy.signal's cspline1d
+def _coeff_smooth(lam):
+    xi = 1 - 96 * lam + 24 * lam * np.sqrt(3 + 144 * lam)
+    omeg = np.arctan2(np.sqrt(144 * lam - 1), np.sqrt(xi))
+    rho = (24 * lam - 1 - np.sqrt(xi)) / (24 * lam)
+    rho = rho * np.sqrt((48 * lam + 24 * lam * np.sqrt(3 + 144 * lam)) / xi)
+    return rho, omeg
+
+def _hc(k, cs, rho, omega):
+    return (cs / np.sin(omega) * (rho ** k) * np.sin(omega * (k + 1)) *
+            np.greater(k, -1))
+
+def _hs(k, cs, rho, omega):
+    c0 = (cs * cs * (1 + rho * rho) / (1 - rho * rho) /
+          (1 - 2 * rho * rho * np.cos(2 * omega) + rho ** 4))
+    gamma = (1 - rho * rho) / (1 + rho * rho) / np.tan(omega)
+    ak = abs(k)
+    return c0 * rho ** ak * (np.cos(omega * ak) + gamma * np.sin(omega * ak))
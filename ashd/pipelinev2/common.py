@@ -1,4 +1,5 @@
 import sep
+import numpy as np
 
 # use sep to get a total listing of the objects from the given image `data`
 def get_objs(data, byteswap = False):
@@ -15,4 +16,23 @@ def cut_corners(objlist, thresh=30, size=[2048, 2048]):
         x = i['x']; y = i['y']
         if not (x < thresh and y < thresh) and not (x > (size[0] - thresh) and y < thresh):
             if not (x < thresh and y > (size[1] - thresh)) and not (x > (size[0] - thresh) and y > (size[1] - thresh)):
-                yield i
\ No newline at end of file
+                yield i
+
+# vectorized `cut_corners`: a boolean mask of the objects outside the corner regions
+def corner_mask(objects, thresh=30, size=[2048, 2048]):
+    x = objects['x']; y = objects['y']
+    left = x < thresh; right = x > (size[0] - thresh)
+    bottom = y < thresh; top = y > (size[1] - thresh)
+    return ~((left | right) & (bottom | top))
+
+# indices of the `k` largest `values`, largest first; ties keep their original order,
+# i.e. the same as a stable descending sort (Python's `sorted(..., reverse=True)`) cut to `k`
+def top_k(values, k=None):
+    values = np.asarray(values)
+    n = values.size
+    if k is None or k >= n: return np.argsort(-values, kind='stable')
+    if k <= 0: return np.empty(0, dtype=np.intp)
+    # everything at least as large as the k-th largest value, in index order
+    kth = values[np.argpartition(values, n - k)[n - k]]
+    cand = np.flatnonzero(values >= kth)
+    return cand[np.argsort(-values[cand], kind='stable')][:k]
@@ -11,34 +11,104 @@ SEP_DTYPE = [('thresh', '<f8'), ('npix', '<i8'), ('tnpix', '<i8'), ('xmin', '<i8
 
 SQL_DTYPE=[("id", "<i8"), ("ra", "<f8"), ("dec", "<f8")]
 
+CUTOUT_FN = "cutouts.bin"
+
+# all the cutouts of a run appended to one flat file, indexed by uid in the run db's `cutouts` table;
+# each cutout keeps the tile header with its WCS shifted to the cutout's origin
+class CutoutArchive:
+    def __init__(self, target, conn, mode='r'):
+        self.conn = conn
+        self.fn = os.path.join(target, CUTOUT_FN)
+        if mode == 'a':
+            conn.execute("create table if not exists cutouts (id text primary key, offset integer, "
+                         "nbytes integer, ny integer, nx integer, dtype text, header text)")
+            conn.commit()
+            # drop any bytes appended by a group that never committed
+            end = conn.execute("select max(offset + nbytes) from cutouts").fetchone()[0] or 0
+            self.file = open(self.fn, 'ab')
+            self.file.truncate(end)
+            self.file.seek(end)
+
+    # appends a cutout whose lower-left corner is at tile pixel (xmin, ymin); call `flush` before committing
+    def append(self, uid, data, header, xmin, ymin):
+        data = np.ascontiguousarray(data)
+        header = header.copy()
+        if 'CRPIX1' in header: header['CRPIX1'] -= xmin
+        if 'CRPIX2' in header: header['CRPIX2'] -= ymin
+        offset = self.file.tell()
+        self.file.write(data.tobytes())
+        self.conn.execute("insert or replace into cutouts values (?, ?, ?, ?, ?, ?, ?)",
+                          (uid, offset, data.nbytes, data.shape[0], data.shape[1], data.dtype.str,
+                           header.tostring()))
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+    def __contains__(self, uid):
+        return self.conn.execute("select 1 from cutouts where id = ?", (uid,)).fetchone() is not None
+
+    # reads one cutout with a single seek + read
+    def get(self, uid):
+        row = self.conn.execute("select offset, ny, nx, dtype, header from cutouts where id = ?", (uid,)).fetchone()
+        if row is None: raise KeyError(uid)
+        offset, ny, nx, dtype, header = row
+        data = np.fromfile(self.fn, dtype=dtype, count=ny * nx, offset=offset).reshape(ny, nx)
+        return fits.PrimaryHDU(data, fits.Header.fromstring(header))
+
 class Reader:
     def __init__(self, target, autoload = True):
         self.target = target
         db = os.path.join(self.target, 'db')
         #print(f"sqlite:///{db}", os.path.exists(db))
         self.conn = sqlite3.Connection(db)
+        has_archive = self.conn.execute("select 1 from sqlite_master where name = 'cutouts'").fetchone()
+        self.archive = CutoutArchive(self.target, self.conn) if has_archive else None
         if autoload: self.load()
     
     def load(self):
         c = self.conn.cursor()
-        self.extra_data = []
-        for row in c.execute("select count(*) from findings"): np_table = np.empty(row[0], dtype=SEP_DTYPE)
-        
-        pos = 0
-        #ra = []; dec = []
-        for row in c.execute("select * from findings"):
-            self.extra_data.append(row[0:4])
-            np_table[pos] = np.fromstring(row[4], dtype=SEP_DTYPE)
-            pos += 1
-        self.data = pd.DataFrame(np_table)
-        self.data['ra'] = [i[2] for i in self.extra_data]
-        self.data['dec'] = [i[3] for i in self.extra_data]
-        
+        rows = c.execute("select id, hash, ra, dec, properties from findings").fetchall()
+        self.extra_data = [row[0:4] for row in rows]
+        self.data = self._to_frame(rows)
+
+    def iter_chunks(self, chunksize=100000):
+        """
+        Yield the findings as DataFrames of at most `chunksize` rows, for
+        result databases that do not fit in memory.
+        """
+        c = self.conn.cursor()
+        c.execute("select id, hash, ra, dec, properties from findings")
+        while True:
+            rows = c.fetchmany(chunksize)
+            if not rows:
+                break
+            yield self._to_frame(rows)
+
+    @staticmethod
+    def _to_frame(rows):
+        # all the property blobs are fixed-size SEP records, so the whole
+        # table is decoded with a single frombuffer over the joined bytes
+        if rows:
+            _, _, ra, dec, props = zip(*rows)
+        else:
+            ra, dec, props = (), (), ()
+        np_table = np.frombuffer(b''.join(props), dtype=SEP_DTYPE)
+        data = pd.DataFrame(np_table)
+        data['ra'] = np.array(ra, dtype=float)
+        data['dec'] = np.array(dec, dtype=float)
+        return data
     
     def get_img(self, id):
         fname = id
         if type(id) != str:
             fname = np.base_repr(id, 36)
+        if self.archive is not None and fname in self.archive:
+            return self.archive.get(fname)
+        # runs from before the cutout archive have one fits file per finding
         return fits.open(os.path.join(self.target, f"{fname}.fits"))[0]
 
         
\ No newline at end of file
@@ -3,9 +3,10 @@
 import astropy
 import numpy as np
 
-from ashd import Butler
+from ashd import Butler, Scheduler, tile_costs
+from ashd import database
+from ashd.database import Writer
 
-from astropy.io import fits
 from astropy import units as u
 from astropy.coordinates import SkyCoord
 
@@ -16,6 +17,7 @@ import os, glob, sys, argparse
 import sqlite3, multiprocessing, logging
 
 from common import get_objs
+from reader import CutoutArchive
 from global_vals import *
 
 # algo1 can be replaced with with algo2 (or whichever one you want to use)
@@ -25,45 +27,91 @@ import algo1 as algo
 def unwrap(coord): return (coord.ra.deg, coord.dec.deg)
 def objhash(obj): return np.base_repr(abs(hash(obj.tostring())), 36).lower()
 
-# the main processing method; called in each process
-def process(coord, butler, logstr='', **kwargs):
-    c = unwrap(coord)
+# the Butler of each worker process; built once by `init_worker` so tasks only carry a field id
+butler = None
+
+# pool initializer; the tile index on disk is usually up to date, so this only maps it, but if
+# it doesn't list the main process's `files` (e.g. it could not be written) it is rebuilt,
+# so that field ids mean the same tiles in every process
+def init_worker(source, files):
+    global butler
+    butler = Butler(source, update_index=False, files=files)
+
+# the main processing method; called in each process with the id of a field (unique tile center)
+def process(field_id, logstr='', **kwargs):
+    c = unwrap(butler.unique_coords[field_id])
     logging.debug(f"[Process {multiprocessing.current_process().pid}] [Coordinate {c}] {logstr}")
     img = butler.get_image(*c)
+    tile = os.path.basename(img.image_fn)
     #dsub = img.data.byteswap().newbyteorder()
     objects, *_ = get_objs(img.data)
-    lbgs = algo.find_lbg(objects, img.data)
+    lbgs = objects[algo.select_lbg(objects, img.data)]
     out = []
-    for obj in lbgs:
-        coord = img.pix_to_sky([obj['x'], obj['y']])
+    ra, dec = img.xy_to_radec(lbgs['x'], lbgs['y'])
+    for obj, coord in zip(lbgs, zip(ra, dec)):
         # create a cutout
         zoomed_img = img.data[obj['ymin']:obj['ymax'], obj['xmin']:obj['xmax']]
         logging.info(f"At {coord}: {str(obj)}; Hash: {objhash(obj)}")
         out.append((coord, obj, zoomed_img))
-    return (out, img.header)
+    return (out, img.header, tile)
+
+# single-argument form of `process` for the scheduler
+def process_task(task): return process(*task)
         
-# takes the output of `process` and writes it to the sqlite table and creates image files of the cutouts
-def callback(params):
-    global objCount, args
-    objlist, header = params
-    for i in objlist:
-        coord, obj, zoomed = i
-        uid = np.base_repr(objCount, 36)
-        h = objhash(obj)
-        logging.debug(f"Writing {coord} with id {uid} of hash {h}")
-        #cur = conn.cursor()
-        c.execute("insert into findings values (?, ?, ?, ?, ?)",
-                    (uid, h, coord[0], coord[1], obj.tostring()))
-        hdu = fits.PrimaryHDU(zoomed)
-        hdu.header = header
-        hdu.writeto(os.path.join(args.output_dir, f"{uid}.fits"))
-        objCount += 1
+# creates the run tables if needed; `tiles` is the manifest of finished tiles
+def open_run_db(output_dir):
+    conn = sqlite3.connect(os.path.join(output_dir, "db"))
+    conn.execute("create table if not exists findings (id text, hash text, ra real, dec real, properties text)")
+    conn.execute("create table if not exists tiles (fn text primary key, n_findings integer)")
+    conn.commit()
+    return conn
+
+# the tiles that a previous (possibly crashed) run in `output_dir` already finished
+def finished_tiles(output_dir):
+    if not os.path.exists(os.path.join(output_dir, "db")): return set()
+    conn = open_run_db(output_dir)
+    done = {row[0] for row in conn.execute("select fn from tiles")}
+    conn.close()
+    return done
+
+# writes the output of `process` to the sqlite table and appends the cutouts to the run's archive
+# this runs in the dedicated writer process, so the pool never waits on disk
+class FindingsSink:
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.conn = open_run_db(output_dir)
+        self.archive = CutoutArchive(output_dir, self.conn, mode='a')
+        # a counter for the total list of objects that only exists in the writer process;
+        # ids continue from where a resumed run left off
+        self.objCount = self.conn.execute("select count(*) from findings").fetchone()[0]
+
+    def write(self, group):
+        # one transaction per group of processed images; a tile is marked finished in the
+        # same transaction as its findings, so a crash never leaves a tile half recorded
+        with self.conn:
+            for objlist, header, tile in group:
+                self.conn.execute("insert or replace into tiles values (?, ?)", (tile, len(objlist)))
+                for coord, obj, zoomed in objlist:
+                    uid = np.base_repr(self.objCount, 36)
+                    h = objhash(obj)
+                    logging.debug(f"Writing {coord} with id {uid} of hash {h}")
+                    self.conn.execute("insert into findings values (?, ?, ?, ?, ?)",
+                                      (uid, h, coord[0], coord[1], obj.tostring()))
+                    self.archive.append(uid, zoomed, header, obj['xmin'], obj['ymin'])
+                    self.objCount += 1
+            # the cutouts are on disk before their index rows commit
+            self.archive.flush()
+
+    def close(self):
+        self.archive.close()
+        self.conn.close()
+        logging.info(f"{self.objCount} objects found.")
 
 #%%
 if __name__ == "__main__":
     logging.basicConfig(format=f"[%(asctime)s][%(levelname)s] %(message)s", level=logging.DEBUG)
 
-    run = len(glob.glob("./out*.db"))
+    run = len(glob.glob("./out*"))
 
     parser = argparse.ArgumentParser(description="Try and find dwarf galaxies from the asas-sn data.")
 
@@ -76,9 +124,15 @@ if __name__ == "__main__":
     parser.add_argument('--processes', type=int, default=4,
                         help="how many processes to execute on")
     parser.add_argument('--output-dir', type=str, default=f'./out{run}',
-                        help="the output directory to dump")
+                        help="the output directory to dump; an existing run there is resumed, skipping finished tiles")
     parser.add_argument('--max-processed', type=int, default=None,
-                        help="if you have a large source directory, we will only take the first `MAX_PROCESSED` images")
+                        help="if you have a large source directory, we will only take the first `MAX_PROCESSED` unfinished images")
+    parser.add_argument('--chunksize', type=int, default=1,
+                        help="how many tiles are sent to a worker at once")
+    parser.add_argument('--counts-db', type=str, default=None,
+                        help="pipeline database of a previous run whose per-image source counts are used to schedule the expensive tiles first")
+    parser.add_argument('--writer-queue-size', type=int, default=64,
+                        help="how many processed images can wait for the writer before the pool is held back")
 
     args = parser.parse_args()
 
@@ -89,24 +143,39 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
     logging.info(f"Running with {args.processes} processes. Process {multiprocessing.current_process().pid} is the main process.")
-    conn = sqlite3.connect(os.path.join(args.output_dir, "db"), check_same_thread=False)
-    c = conn.cursor()
-    c.execute("create table findings (id text, hash text, ra real, dec real, properties text)")
-
-    pool = multiprocessing.Pool(args.processes)
-    cnt = args.max_processed if (args.max_processed and args.max_processed < len(butler.unique_coords)) else len(butler.unique_coords)
-
-    # a counter for the total list of objects that only exists in the main process
-    objCount = 0
+    writer = Writer(FindingsSink, (args.output_dir,), maxsize=args.writer_queue_size)
+    writer.start()
+
+    # resume: skip the tiles the manifest says are done, which also lets a finished run
+    # be extended to tiles added to the source directory since
+    done = finished_tiles(args.output_dir)
+    tiles = [os.path.basename(fn) for fn in butler.get_image_fns(butler.unique_coords)]
+    todo = [i for i, tile in enumerate(tiles) if tile not in done]
+    logging.info(f"{len(tiles) - len(todo)} of {len(tiles)} tiles already finished.")
+    if args.max_processed: todo = todo[:args.max_processed]
+    cnt = len(todo)
 
     logging.info(f"Processing {cnt} coordinates.")
 
-    for i in range(cnt):
-        coord = butler.unique_coords[i]
-        pool.apply_async(process, args=(coord, butler, f"Index {i + 1}/{cnt}"), callback=callback)
+    # dispatch the expensive (dense) tiles first so they don't straggle at the end
+    counts = None
+    if args.counts_db:
+        database.connect(args.counts_db)
+        counts = database.source_counts(database.Session())
+    costs = tile_costs(butler, counts)[todo]
+    scheduler = Scheduler(costs, chunksize=args.chunksize)
+
+    pool = multiprocessing.Pool(args.processes, initializer=init_worker, initargs=(args.source, butler.files))
+    tasks = [(i, f"Index {n + 1}/{cnt}") for n, i in enumerate(todo)]
+    # tiles that raise are skipped by the scheduler; they stay out of the manifest, so a
+    # resumed run retries them
+    for result in scheduler.run(pool, process_task, tasks):
+        writer.put(result)
     pool.close()
     pool.join()
-    
-    conn.commit()
-    conn.close()
-    logging.info(f"{objCount} objects found.")
+    writer.close()
+    for (field_id, _), error in scheduler.failures:
+        logging.error(f"Tile {tiles[field_id]} failed:\n{error}")
+    if cnt:
+        logging.info(scheduler.summary())
+        logging.info(f"Per-worker utilization:\n{scheduler.utilization()}")
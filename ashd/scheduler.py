@@ -0,0 +1,162 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import time
+import traceback
+import numpy as np
+import pandas as pd
+
+__all__ = ['tile_costs', 'Scheduler']
+
+
+def tile_costs(butler, counts=None, min_lat=5.0):
+    """
+    Estimate the relative cost of processing each field of a Butler.
+
+    Fields with a cached source count (e.g., from a previous run) use
+    it. The others are estimated from the stellar density, which is
+    modeled as csc|b| in Galactic latitude (capped at min_lat), scaled
+    to the cached counts when there are any.
+
+    Parameters
+    ----------
+    butler : ashd.Butler
+        Butler of the data directory.
+    counts : dict, optional
+        Source count per image label (stack file name without .fits).
+    min_lat : float, optional
+        Latitude (deg) below which the density model saturates.
+
+    Returns
+    -------
+    costs : ndarray
+        Relative cost of each field in butler.unique_coords.
+    """
+    b = butler.unique_coords.galactic.b.deg
+    costs = 1.0 / np.sin(np.deg2rad(np.clip(np.abs(b), min_lat, 90)))
+    if counts:
+        labels = [os.path.basename(fn)[:-5]
+                  for fn in butler.get_image_fns(butler.unique_coords)]
+        cached = np.array([counts.get(l, np.nan) for l in labels], dtype=float)
+        known = ~np.isnan(cached)
+        if known.any():
+            costs *= np.median(cached[known] / costs[known])
+            costs[known] = cached[known]
+    return costs
+
+
+class _Timed(object):
+    """
+    Picklable wrapper that records which worker ran a task and for
+    how long. An exception raised by the task is caught and returned
+    as its formatted traceback (exceptions need not be picklable), so
+    one bad tile does not abort the run.
+    """
+
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, task):
+        start = time.time()
+        try:
+            result, error = self.func(task), None
+        except Exception:
+            result, error = None, traceback.format_exc()
+        return os.getpid(), start, time.time(), task, result, error
+
+
+class Scheduler(object):
+    """
+    Dispatch tasks to a pool in order of decreasing cost, so the
+    expensive tiles (e.g., dense Galactic-plane fields) start first
+    instead of ending up as stragglers, and keep track of how busy
+    each worker was.
+
+    Parameters
+    ----------
+    costs : array-like
+        Estimated cost of each task (see tile_costs).
+    chunksize : int, optional
+        Number of tasks sent to a worker at once. Larger chunks cut
+        dispatch overhead; smaller chunks balance the load better.
+    """
+
+    def __init__(self, costs, chunksize=1):
+        self.costs = np.asarray(costs, dtype=float)
+        self.chunksize = chunksize
+        self.timings = []
+        self.failures = []
+        self.wall_time = 0.0
+
+    def order(self):
+        """
+        Task indices, most expensive first.
+        """
+        return np.argsort(-self.costs, kind='mergesort')
+
+    def run(self, pool, func, tasks):
+        """
+        Run func over tasks in the pool, yielding the results as they
+        complete. Pools without imap_unordered (e.g., schwimmbad's
+        MPIPool) are given the ordered tasks through map. Tasks that
+        raise are skipped and recorded in self.failures as (task,
+        traceback) pairs.
+
+        Parameters
+        ----------
+        pool : multiprocessing.Pool or schwimmbad pool
+            Pool of workers.
+        func : callable
+            Picklable function of a single task.
+        tasks : list
+            Tasks, in the same order as costs.
+        """
+        if len(tasks) != len(self.costs):
+            raise ValueError('got {} tasks for {} costs'.format(
+                len(tasks), len(self.costs)))
+        ordered = [tasks[i] for i in self.order()]
+        self.timings = []
+        self.failures = []
+        start = time.time()
+        if hasattr(pool, 'imap_unordered'):
+            results = pool.imap_unordered(_Timed(func), ordered,
+                                          chunksize=self.chunksize)
+        else:
+            results = pool.map(_Timed(func), ordered)
+        for pid, t0, t1, task, result, error in results:
+            self.timings.append((pid, t0, t1))
+            self.wall_time = time.time() - start
+            if error is not None:
+                self.failures.append((task, error))
+                continue
+            yield result
+
+    def utilization(self):
+        """
+        Per-worker report of the last run.
+
+        Returns
+        -------
+        report : pandas.DataFrame
+            Number of tasks, busy time (s) and fraction of the wall
+            time each worker was busy, indexed by worker pid.
+        """
+        timings = pd.DataFrame(self.timings, columns=['pid', 'start', 'end'])
+        timings['busy'] = timings.end - timings.start
+        grouped = timings.groupby('pid').busy
+        report = pd.DataFrame({'n_tasks': grouped.size(),
+                               'busy': grouped.sum()})
+        report['utilization'] = report.busy / max(self.wall_time, 1e-9)
+        return report
+
+    def summary(self):
+        """
+        One-line summary of the last run for logging.
+        """
+        report = self.utilization()
+        return ('{} tasks ({} failed) on {} workers in {:.1f} s; '
+                'utilization mean {:.0%}, min {:.0%}').format(
+                    int(report.n_tasks.sum()), len(self.failures),
+                    len(report), self.wall_time,
+                    report.utilization.mean(), report.utilization.min())
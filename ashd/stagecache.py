@@ -0,0 +1,112 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+
+__all__ = ['StageCache']
+
+
+def _to_json(obj):
+    # numpy scalars and arrays in the parameters (e.g., from np.arange)
+    if isinstance(obj, (np.generic, np.ndarray)):
+        return obj.tolist()
+    raise TypeError('cannot hash {!r} in a cache key'.format(obj))
+
+
+class StageCache(object):
+    """
+    Content-addressed on-disk cache of intermediate pipeline products
+    (e.g., the ring-filtered image and the background map).
+
+    Each entry is a directory of .npy files named by a hash of the
+    tile (file name, mtime, and size), the dtype of the pixels the
+    stages started from (e.g., the raw FITS data or its float32
+    cache_dir copy), the stage name, and the parameters the stage
+    depends on. Entries are written atomically
+    and loaded as copy-on-write memory maps, so parameter sweeps that
+    only change later stages skip the expensive ones.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory of the cache. Created if needed.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def key(self, image_fn, dtype, stage, params):
+        """
+        Cache key of a stage's products.
+
+        Parameters
+        ----------
+        image_fn : str
+            The tile the products were computed from.
+        dtype : numpy.dtype or str
+            Data type of the tile's pixels as loaded.
+        stage : str
+            Name of the stage.
+        params : dict
+            Every parameter that the stage and the stages before it
+            depend on.
+        """
+        st = os.stat(image_fn)
+        ident = [os.path.basename(image_fn), st.st_mtime, st.st_size,
+                 np.dtype(dtype).name, stage, sorted(params.items())]
+        digest = hashlib.sha1(json.dumps(ident, default=_to_json).encode(
+            'utf-8')).hexdigest()
+        return '{}-{}'.format(stage, digest)
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key):
+        """
+        Load an entry as {name: array}, or None if it is not cached.
+        """
+        path = self.path(key)
+        if not os.path.isdir(path):
+            return None
+        return {fn[:-4]: np.load(os.path.join(path, fn), mmap_mode='c')
+                for fn in os.listdir(path) if fn.endswith('.npy')}
+
+    def put(self, key, products):
+        """
+        Write the {name: array} products of an entry and return them
+        as loaded from the cache.
+        """
+        path = self.path(key)
+        tmp_path = path + '.{}.tmp'.format(os.getpid())
+        os.makedirs(tmp_path, exist_ok=True)
+        for name, arr in products.items():
+            np.save(os.path.join(tmp_path, name + '.npy'), np.asarray(arr))
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # another process wrote the same entry first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        return self.get(key)
+
+    def cached(self, image_fn, dtype, stage, params, compute):
+        """
+        Return the products of a stage from the cache, calling
+        compute() to make and store them on a miss. The arguments
+        besides compute are those of key.
+
+        Returns
+        -------
+        products : dict
+            {name: array} products of the stage.
+        hit : bool
+            True if the products came from the cache.
+        """
+        key = self.key(image_fn, dtype, stage, params)
+        products = self.get(key)
+        if products is not None:
+            return products, True
+        return self.put(key, compute()), False
@@ -0,0 +1,169 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import copy
+import time
+import itertools
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from astropy import units as u
+from .butler import Butler
+from .image import ASHDImage
+from .params import PipeParams
+from .pipeline import (stage_kws, ring_stage, background_stage,
+                       extract_stage)
+
+__all__ = ['param_grid', 'sweep']
+
+
+def param_grid(**grid):
+    """
+    All combinations of PipeParams values.
+
+    Example: param_grid(thresh=[1.0, 1.5], r_outer=[6.0, 8.0]) gives
+    four {'thresh': ..., 'r_outer': ...} dicts.
+    """
+    names = sorted(grid)
+    return [dict(zip(names, values))
+            for values in itertools.product(*[grid[n] for n in names])]
+
+
+def _key(kws):
+    return tuple(sorted(kws.items()))
+
+
+def _timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return result, time.time() - start
+
+
+# (func, items) of the running _fork_map, inherited by its workers
+_fork_state = None
+
+
+def _fork_task(i):
+    func, items = _fork_state
+    return _timed(func, items[i])
+
+
+def _fork_map(func, items, n_processes):
+    """
+    Timed map of func over items in a pool of forked processes. The
+    workers inherit func and the arrays it uses (e.g., the shared
+    ring-filtered images and backgrounds) instead of receiving them
+    pickled; only the results are sent back.
+    """
+    global _fork_state
+    if n_processes <= 1 or len(items) <= 1:
+        return [_timed(func, item) for item in items]
+    _fork_state = (func, items)
+    try:
+        context = multiprocessing.get_context('fork')
+        with context.Pool(min(n_processes, len(items))) as pool:
+            return pool.map(_fork_task, range(len(items)))
+    finally:
+        _fork_state = None
+
+
+def sweep(grid, ra=None, dec=None, unit=u.deg, image_fn=None, params=None,
+          butler=None, n_threads=1, n_processes=1, return_sources=False):
+    """
+    Run source detection on one image for many parameter
+    configurations. The stages form a tree: configurations with the
+    same ring filter parameters share the ring-filtered image, and
+    those that also share the background parameters share the
+    background, so each distinct stage is computed once. The ring
+    stages run in a thread pool (rmedian releases the GIL). sep
+    holds the GIL, so the background stages and the extractions (the
+    leaves) run in a pool of forked processes instead. The stages are those of ASHDPipe.detect, so if
+    params.stage_cache_dir is set they also go through the on-disk
+    StageCache.
+
+    Parameters
+    ----------
+    grid : list of dict or dict
+        Configurations, as dicts of PipeParams attributes to change,
+        or a dict of lists passed to param_grid.
+    ra, dec : float, optional
+        Coordinates of the image. Or give image_fn.
+    unit : astropy.units.Unit or str, optional
+        Unit of coordinates
+    image_fn : str, optional
+        Image file name.
+    params : PipeParams, optional
+        Parameters that the configurations start from.
+    butler : Butler, optional
+        Butler of the data directory. Defaults to params.data_dir.
+    n_threads : int, optional
+        Number of threads for the ring stages.
+    n_processes : int, optional
+        Number of processes for the background and extract stages.
+        Needs the fork start method (i.e., not Windows).
+    return_sources : bool, optional
+        If True, also return the sources of each configuration.
+
+    Returns
+    -------
+    results : pandas.DataFrame
+        One row per configuration: the changed parameters, the number
+        of sources, the time (s) of its ring, background and extract
+        stages, and how many configurations share its ring and
+        background stages.
+    sources : list of pandas.DataFrame
+        The sep sources of each configuration, if return_sources.
+    """
+    base = params if params else PipeParams()
+    configs = param_grid(**grid) if isinstance(grid, dict) else list(grid)
+    all_params = []
+    for overrides in configs:
+        p = copy.copy(base)
+        for name, value in overrides.items():
+            if not hasattr(p, name):
+                raise AttributeError('PipeParams has no {}'.format(name))
+            setattr(p, name, value)
+        all_params.append(p)
+
+    butler = butler if butler else Butler(base.data_dir)
+    image = ASHDImage(butler, ra=ra, dec=dec, unit=unit, image_fn=image_fn,
+                      cache_dir=base.cache_dir)
+
+    # the distinct stages, each run with the params of one of the
+    # configurations that need it
+    ring_keys = [_key(stage_kws('ring', p)) for p in all_params]
+    bkg_keys = [_key(stage_kws('background', p)) for p in all_params]
+    ring_nodes = dict(zip(ring_keys, all_params))
+    bkg_nodes = dict(zip(bkg_keys, zip(ring_keys, all_params)))
+
+    def ring(p):
+        return ring_stage(image, image.data, p)[0]
+    def background(node):
+        ring_key, p = node
+        return background_stage(image, rings[ring_key][0], p)[0]
+    def extract(i):
+        p, data = all_params[i], rings[ring_keys[i]][0]
+        bkg = bkgs[bkg_keys[i]][0]
+        result = extract_stage(data - bkg['back'], bkg, p)
+        return result[0] if p.segmentation_map else result
+
+    with ThreadPoolExecutor(n_threads) as pool:
+        rings = dict(zip(ring_nodes, pool.map(
+            lambda p: _timed(ring, p), ring_nodes.values())))
+    bkgs = dict(zip(bkg_nodes, _fork_map(
+        background, list(bkg_nodes.values()), n_processes)))
+    leaves = _fork_map(extract, list(range(len(all_params))), n_processes)
+    image.close()
+
+    results = pd.DataFrame(configs)
+    results['n_sources'] = [len(sources) for sources, _ in leaves]
+    results['ring_time'] = [rings[k][1] for k in ring_keys]
+    results['background_time'] = [bkgs[k][1] for k in bkg_keys]
+    results['extract_time'] = [dt for _, dt in leaves]
+    ring_counts, bkg_counts = Counter(ring_keys), Counter(bkg_keys)
+    results['ring_shared'] = [ring_counts[k] for k in ring_keys]
+    results['background_shared'] = [bkg_counts[k] for k in bkg_keys]
+    if return_sources:
+        return results, [pd.DataFrame(sources) for sources, _ in leaves]
+    return results
@@ -0,0 +1,54 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import numpy as np
+import pytest
+from astropy.io import fits
+
+# (file name, sb_sig) of the fake stacks; the two F0440-30 stacks 
+# cover the same field and must be resolved by SB_SIG
+TILES = [('F0000-30_1.fits', 1.0), 
+         ('F0440-30_1.fits', 2.0), 
+         ('F0440-30_2.fits', 3.0), 
+         ('F1200+00_1.fits', 1.0), 
+         ('F2420+60_1.fits', 1.0)]
+
+
+def make_tile(path, fn, sb_sig, size=64, seed=0, n_blobs=0):
+    from ashd.tileindex import parse_tile_fn
+    ra, dec = parse_tile_fn(fn)
+    header = fits.Header()
+    header['CTYPE1'] = 'RA---TAN'
+    header['CTYPE2'] = 'DEC--TAN'
+    header['CRVAL1'] = ra
+    header['CRVAL2'] = dec
+    header['CRPIX1'] = (size + 1) / 2
+    header['CRPIX2'] = (size + 1) / 2
+    header['CD1_1'] = -7.8/3600
+    header['CD1_2'] = 0.0
+    header['CD2_1'] = 0.0
+    header['CD2_2'] = 7.8/3600
+    header['SB_SIG'] = sb_sig
+    header['ZEROPT'] = 20.0
+    rng = np.random.RandomState(seed)
+    data = rng.normal(100, 10, (size, size))
+    # gaussian sources of random widths and peaks
+    for _ in range(n_blobs):
+        x0, y0 = rng.uniform(0, size, 2)
+        sigma, peak = rng.uniform(2, 15), rng.uniform(20, 300)
+        y, x = np.ogrid[max(int(y0 - 5*sigma), 0):int(y0 + 5*sigma) + 1,
+                        max(int(x0 - 5*sigma), 0):int(x0 + 5*sigma) + 1]
+        y, x = y[y < size][:, None], x[x < size][None]
+        r2 = ((x - x0)**2 + (y - y0)**2) / sigma**2
+        data[y, x] += peak * np.exp(-0.5 * r2)
+    data = data.astype('>f4')
+    fits.writeto(os.path.join(path, fn), data, header, overwrite=True)
+
+
+@pytest.fixture
+def tile_dir(tmpdir):
+    path = str(tmpdir)
+    for seed, (fn, sb_sig) in enumerate(TILES):
+        make_tile(path, fn, sb_sig, seed=seed)
+    return path
@@ -0,0 +1,167 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import sys
+import numpy as np
+import pytest
+from scipy import signal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+                                os.pardir, 'pipelinev2'))
+import algo1
+import algo2
+from common import cut_corners, corner_mask, top_k
+from reader import SEP_DTYPE
+
+SIZE = 2048
+
+
+def _find_lbg_algo1(objects, data, **kwargs):
+    # the previous algo1.find_lbg, built on sorted and cut_corners
+    if not kwargs.get('corners', False): objects = np.array(list(cut_corners(objects, thresh=500)))
+    percentiles = kwargs.get('percentiles', [10,99])
+
+    avgsb = np.mean(objects['cflux'] / objects['npix'])
+
+    brightsort = sorted(objects, key=lambda x: x['cflux'] / x['npix']); cnt = len(brightsort)
+    largest = sorted(brightsort[cnt * percentiles[0] // 100 : cnt * percentiles[1] // 100],
+                    key=lambda x: x['npix'], reverse=True)[0:kwargs.get('maxtries', algo1.MAX_TRIES)]
+    found = 0; maxfindings = kwargs.get('maxfindings', algo1.MAX_FINDINGS)
+    for obj in largest:
+        sb = obj['cflux'] / obj['npix']
+        if sb < avgsb:
+            found += 1
+            yield obj
+            if found > maxfindings: break
+
+
+def _find_lbg_algo2(objects, data, **kwargs):
+    # the previous algo2.find_lbg, one is_lbg per object
+    maxtries = kwargs.get('maxtries', objects.size)
+    if not kwargs.get('corners', False): objects = np.array(list(cut_corners(objects, thresh=500)))
+
+    largest = sorted(objects, key = lambda x: x['npix'], reverse=True)[0:maxtries]
+    found = 0; maxfindings = kwargs.get('maxfindings', algo2.MAX_FINDINGS)
+    for obj in largest:
+        if algo2.is_lbg(obj, data):
+            found += 1
+            yield obj
+            if found > maxfindings: break
+
+
+def _fake_tile(n, seed=0):
+    """
+    A 2048x2048 tile with n objects. npix and surface brightness take
+    few distinct values, so there are many ties, and a tenth of the
+    objects sit on the corner boundaries. Half of the objects have a
+    peaked profile along their row, so algo2 finds some of them.
+    """
+    rng = np.random.RandomState(seed)
+    objects = np.zeros(n, dtype=SEP_DTYPE)
+    objects['x'] = rng.uniform(0, SIZE, n)
+    objects['y'] = rng.uniform(0, SIZE, n)
+    edges = [499.0, 500.0, 501.0, SIZE - 501.0, SIZE - 500.0, SIZE - 499.0]
+    on_edge = rng.rand(n) < 0.1
+    objects['x'][on_edge] = rng.choice(edges, on_edge.sum())
+    objects['y'][on_edge] = rng.choice(edges, on_edge.sum())
+    objects['npix'] = rng.randint(5, 15, n)
+    objects['cflux'] = objects['npix'] * rng.choice([1.0, 2.0, 3.0, 4.0], n)
+    half_width = rng.randint(3, 40, n)
+    objects['xmin'] = np.clip(objects['x'].astype(int) - half_width, 0, SIZE - 1)
+    objects['xmax'] = np.clip(objects['x'].astype(int) + half_width, 0, SIZE - 1)
+
+    data = rng.normal(0, 1, (SIZE, SIZE)).astype(np.float32)
+    xx = np.arange(SIZE)
+    for obj in objects[rng.rand(n) < 0.5]:
+        profile = 50 * np.exp(-0.5 * ((xx - obj['x']) / 10.0)**2)
+        data[int(obj['y'])] += profile.astype(np.float32)
+    return objects, data
+
+
+def _check_same(selected, objects, baseline):
+    expected = np.array(list(baseline), dtype=objects.dtype)
+    assert selected.dtype.kind == 'i'
+    assert objects[selected].tobytes() == expected.tobytes()
+
+
+def test_corner_mask():
+    objects, _ = _fake_tile(2000)
+    for thresh in [30, 500]:
+        expected = np.array(list(cut_corners(objects, thresh=thresh)))
+        mask = corner_mask(objects, thresh=thresh)
+        assert objects[mask].tobytes() == expected.tobytes()
+
+
+def test_top_k():
+    values = np.random.RandomState(0).randint(0, 5, 100)
+    expected = sorted(range(values.size), key=lambda i: values[i],
+                      reverse=True)
+    for k in [None, 0, 1, 7, 20, 99, 100, 150]:
+        assert list(top_k(values, k)) == expected[:k]
+
+
+@pytest.mark.parametrize('kwargs', [
+    {}, dict(maxtries=200), dict(maxtries=200, maxfindings=50),
+    dict(percentiles=[0, 100], maxtries=5000, maxfindings=5000),
+    dict(corners=True, maxtries=100)])
+def test_select_lbg_algo1(kwargs):
+    for seed in range(3):
+        objects, data = _fake_tile(3000, seed)
+        _check_same(algo1.select_lbg(objects, data, **kwargs), objects,
+                    _find_lbg_algo1(objects, data, **kwargs))
+        assert (np.array(list(algo1.find_lbg(objects, data, **kwargs))).tobytes()
+                == np.array(list(_find_lbg_algo1(objects, data, **kwargs))).tobytes())
+
+
+@pytest.mark.parametrize('kwargs', [
+    {}, dict(maxfindings=50), dict(maxfindings=50, batch_size=7),
+    dict(maxtries=100, maxfindings=5000, batch_size=16),
+    dict(corners=True, maxfindings=20)])
+def test_select_lbg_algo2(kwargs):
+    objects, data = _fake_tile(1000)
+    baseline = {k: v for k, v in kwargs.items() if k != 'batch_size'}
+    selected = algo2.select_lbg(objects, data, **kwargs)
+    assert selected.size > 3
+    _check_same(selected, objects, _find_lbg_algo2(objects, data, **baseline))
+
+
+def test_select_lbg_empty():
+    # every object is in a corner; the previous code raised an
+    # IndexError on the empty re-wrapped array
+    objects, data = _fake_tile(50)
+    objects['x'] = np.where(objects['x'] < SIZE / 2, 10.0, SIZE - 10.0)
+    objects['y'] = np.where(objects['y'] < SIZE / 2, 10.0, SIZE - 10.0)
+    for algo in [algo1, algo2]:
+        assert algo.select_lbg(objects, data).size == 0
+        assert list(algo.find_lbg(objects, data)) == []
+        assert algo.select_lbg(objects[:0], data).size == 0
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+def test_cspline1d_rows(dtype):
+    rng = np.random.RandomState(0)
+    lengths = np.array([2, 3, 17, 60, 61, 200, 3, 60])
+    rows = np.zeros((lengths.size, lengths.max()), dtype)
+    for i, n in enumerate(lengths):
+        rows[i, :n] = rng.normal(100, 10, n)
+    for lamb in [0.5, 1000]:
+        smoothed = algo2.cspline1d_rows(rows, lengths, lamb)
+        assert smoothed.dtype == dtype
+        for i, n in enumerate(lengths):
+            expected = signal.cspline1d(rows[i, :n], lamb)
+            assert smoothed[i, :n].tobytes() == expected.tobytes()
+            assert not smoothed[i, n:].any()
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+def test_is_lbg_batch(dtype):
+    objects, data = _fake_tile(500, seed=1)
+    data = data.astype(dtype)
+    # profiles of many lengths, including ones cut at the tile edges
+    objects['xmin'][:20] = 0
+    objects['xmax'][20:40] = SIZE - 1
+    expected = np.array([algo2.is_lbg(obj, data) for obj in objects])
+    assert expected.any() and not expected.all()
+    assert np.array_equal(algo2.is_lbg_batch(objects, data), expected)
+    assert algo2.is_lbg_batch(objects[:0], data).size == 0
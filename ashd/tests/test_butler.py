@@ -11,3 +11,121 @@ def test_butler():
     assert fn
     data = b.get_data(fn=fn)
     assert data.shape == (2048, 2048)
+
+
+def test_tile_index(tile_dir):
+    import os
+    from ashd.tileindex import TileIndex
+    from conftest import TILES, make_tile
+    index = TileIndex(tile_dir)
+    assert index.files == sorted(fn for fn, _ in TILES)
+    assert os.path.isfile(index.index_fn)
+    assert index['sb_sig'][index.files.index('F0440-30_2.fits')] == 3.0
+    assert index['ra'][index.files.index('F2420+60_1.fits')] == 5.0
+
+    # reloading is a memory-mapped read with nothing to update
+    index = TileIndex(tile_dir)
+    assert not index.update()
+
+    # new and modified tiles are picked up incrementally
+    make_tile(tile_dir, 'F0000-30_1.fits', 5.0, size=32, seed=10)
+    make_tile(tile_dir, 'F0800+30_1.fits', 1.0)
+    assert index.update()
+    assert len(index) == len(TILES) + 1
+    assert index['sb_sig'][0] == 5.0
+    assert index['naxis1'][0] == 32
+
+
+def test_butler_index(tile_dir):
+    b = Butler(tile_dir)
+    assert len(b.files) == len(b.fn_coords) == 5
+    assert len(b.unique_coords) == 4
+    fn = b.get_image_fn(70.1, -29.9)
+    assert fn.endswith('F0440-30_2.fits')
+
+
+def test_nearest_tile(tile_dir):
+    from astropy.coordinates import SkyCoord
+    b = Butler(tile_dir)
+    assert b.get_image_fn(1.0, -31.0).endswith('F0000-30_1.fits')
+    assert b.get_image_fn(359.0, -29.0).endswith('F0000-30_1.fits')
+    assert b.get_image_fn(6.0, 61.0).endswith('F2420+60_1.fits')
+    fn = b.get_image_fn('12h01m00s', '+00d30m00s', 
+                        unit=('hourangle', 'degree'))
+    assert fn.endswith('F1200+00_1.fits')
+    coord = SkyCoord(70.0, -30.0, unit='deg')
+    assert b.get_image_fn(coord).endswith('F0440-30_2.fits')
+
+
+def test_batch_lookup(tile_dir):
+    import numpy as np
+    b = Butler(tile_dir)
+    ra = np.array([1.0, 70.0, 359.5, 180.0, 69.0])
+    dec = np.array([-31.0, -30.0, -30.0, 0.5, -29.0])
+    fns = b.get_image_fns(ra, dec)
+    assert list(fns) == [b.get_image_fn(r, d) for r, d in zip(ra, dec)]
+    groups = b.group_image_fns(ra, dec)
+    assert len(groups) == 3
+    assert list(groups[fns[0]]) == [0, 2]
+    assert list(groups[fns[1]]) == [1, 4]
+    assert list(groups[fns[3]]) == [3]
+
+
+def test_no_header_reads(tile_dir, monkeypatch):
+    from astropy.io import fits
+    b = Butler(tile_dir)
+    def fail(*args, **kwargs):
+        raise AssertionError('header read during lookup')
+    monkeypatch.setattr(fits, 'getheader', fail)
+    for _ in range(3):
+        assert b.get_image_fn(70.0, -30.0).endswith('F0440-30_2.fits')
+    assert b.get_sb_sig(image_fn='F0440-30_1.fits') == 2.0
+
+
+def test_get_cutouts(tile_dir, tmpdir):
+    import numpy as np
+    from astropy.io import fits
+    from astropy.wcs import WCS
+    from ashd.imutils import make_cutout
+    b = Butler(tile_dir)
+    ra = np.array([0.01, 70.0, 359.99, 180.0, 69.99])
+    dec = np.array([-30.01, -30.0, -29.99, 0.01, -30.02])
+    out_fn = str(tmpdir.join('stamps.fits'))
+    stamps, fns = b.get_cutouts(ra, dec, size=11, write=out_fn)
+    assert stamps.shape == (5, 11, 11)
+    assert list(fns) == list(b.get_image_fns(ra, dec))
+    hdulist = fits.open(out_fn)
+    for i in range(len(ra)):
+        data, header = fits.getdata(fns[i], header=True)
+        cutout = make_cutout(data, (ra[i], dec[i]), header=header, size=11)
+        assert np.array_equal(stamps[i], cutout.data)
+        assert np.array_equal(hdulist[i + 1].data, stamps[i])
+        assert np.allclose(WCS(hdulist[i + 1].header).wcs_world2pix(
+            ra[i], dec[i], 0), 5, atol=0.5)
+
+    # stamps that run off the tile are padded
+    stamps, _ = b.get_cutouts([0.0], [-30.0], size=101)
+    assert stamps.shape == (1, 101, 101)
+    assert np.isnan(stamps).sum() == 101**2 - 64**2
+
+
+def test_worker_index(tile_dir, tmpdir, recwarn):
+    import os
+    import pytest
+    from conftest import make_tile
+    from ashd.tileindex import INDEX_FN
+    # the main process could not write its index, and an older index 
+    # is still on disk
+    Butler(tile_dir)
+    make_tile(tile_dir, 'F0800+30_1.fits', 1.0)
+    unwritable = str(tmpdir.join('missing', 'index.npy'))
+    main = Butler(tile_dir, index_fn=unwritable)
+    for index_fn in [unwritable, os.path.join(tile_dir, INDEX_FN)]:
+        worker = Butler(tile_dir, index_fn=index_fn, update_index=False, 
+                        files=main.files)
+        assert worker.files == main.files
+        assert worker.get_image_fn(main.unique_coords[3]) == \
+            main.get_image_fn(main.unique_coords[3])
+
+    with pytest.raises(RuntimeError):
+        Butler(tile_dir, update_index=False, files=main.files[1:])
@@ -0,0 +1,174 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+import pandas as pd
+import pytest
+from ashd import database
+
+SEP_COLUMNS = ['x', 'y', 'x2', 'y2', 'xy', 'errx2', 'erry2', 'errxy', 
+               'xmin', 'xmax', 'ymin', 'ymax', 'thresh', 'npix', 'tnpix', 
+               'a', 'b', 'theta', 'cxx', 'cyy', 'cxy', 'cflux', 'flux', 
+               'cpeak', 'peak', 'xcpeak', 'ycpeak', 'xpeak', 'ypeak', 'flag']
+
+
+def fake_catalog(num_sources, seed=0, ra_range=(0, 10), dec_range=(-5, 5)):
+    rng = np.random.RandomState(seed)
+    cat = pd.DataFrame({c: rng.uniform(0, 100, num_sources) 
+                        for c in SEP_COLUMNS})
+    for c in ['npix', 'tnpix', 'flag']:
+        cat[c] = cat[c].astype(int)
+    cat['ra'] = rng.uniform(*ra_range, size=num_sources)
+    cat['dec'] = rng.uniform(*dec_range, size=num_sources)
+    cat['mag_auto'] = rng.uniform(10, 20, num_sources)
+    cat.loc[0, 'mag_auto'] = np.nan
+    return cat
+
+
+@pytest.fixture
+def session(tmpdir):
+    database.connect(str(tmpdir.join('test.db')))
+    session = database.Session()
+    yield session
+    session.close()
+    database.Session.remove()
+
+
+def test_add_batch(session):
+    batch = [('tile-{}'.format(i), fake_catalog(50, seed=i)) 
+             for i in range(3)]
+    ingest = database.ASHDIngest(session, 'bulk-run')
+    ingest.add_batch(batch[:2])
+    ingest.add_batch(batch[2:])
+    ingest.add_all('tile-3', fake_catalog(50, seed=3))
+
+    ingest = database.ASHDIngest(session, 'bulk-run')
+    assert session.query(database.Run).count() == 1
+    assert session.query(database.Image).count() == 4
+    sources = pd.read_sql('SELECT * FROM source', session.bind)
+    assert len(sources) == 200
+    first = sources[sources.image_id==1].sort_values('id')
+    cat = batch[0][1]
+    assert np.allclose(first.ra.values, cat.ra.values)
+    assert np.array_equal(first.npix.values, cat.npix.values)
+    assert first.mag_auto.isnull().sum() == 1
+    assert first.flux_auto.isnull().all()
+
+
+def test_writer(tmpdir):
+    from ashd.database import Writer, DatabaseSink
+    db_fn = str(tmpdir.join('writer.db'))
+    cutout = (np.ones((5, 5)), None)
+    with Writer(DatabaseSink, (db_fn, 'writer-run', str(tmpdir)), 
+                maxsize=2, group_size=3) as writer:
+        for i in range(7):
+            cutouts = [('cutout-{}.fits'.format(i),) + cutout]
+            writer.put(('tile-{}'.format(i), fake_catalog(10, i), cutouts))
+    database.connect(db_fn)
+    session = database.Session()
+    assert session.query(database.Image).count() == 7
+    assert session.query(database.Source).count() == 70
+    assert tmpdir.join('cutout-6.fits').check()
+    session.close()
+    database.Session.remove()
+
+
+def test_spatial_search(session):
+    from astropy.coordinates import SkyCoord
+    ingest = database.ASHDIngest(session, 'search-run')
+    cat = fake_catalog(500, seed=1, ra_range=(-20, 20), dec_range=(-20, 20))
+    cat['ra'] %= 360
+    ingest.add_batch([('tile-0', cat.iloc[:400])])
+    ingest.add_all('tile-1', cat.iloc[400:].copy())
+    all_coords = SkyCoord(cat.ra.values, cat.dec.values, unit='deg')
+
+    for ra, dec, radius in [(0.0, 0.0, 5.0), (355.0, 10.0, 8.0), 
+                            (10.0, -15.0, 2.0)]:
+        found = database.cone_search(session, ra, dec, radius)
+        seps = all_coords.separation(SkyCoord(ra, dec, unit='deg')).deg
+        assert len(found) == (seps <= radius).sum()
+        assert np.allclose(np.sort(seps[seps <= radius]), found.separation)
+
+    found = database.box_search(session, 350, 10, -5, 5)
+    in_box = ((cat.ra >= 350) | (cat.ra <= 10)) & (cat.dec.abs() <= 5)
+    assert sorted(found.ra) == sorted(cat.ra[in_box])
+
+    session.execute(database.Source.__table__.delete().where(
+        database.Source.id > 450))
+    session.commit()
+    assert len(database.box_search(session, 0, 360, -90, 90)) == 450
+    assert database.build_spatial_index(session) == 0
+
+    # the freed ids are reused by the next ingest
+    more = fake_catalog(100, seed=3, ra_range=(0, 10), dec_range=(-5, 5))
+    ingest.add_batch([('tile-2', more.iloc[:50])])
+    ingest.add_all('tile-3', more.iloc[50:].copy())
+    found = database.box_search(session, 0, 360, -90, 90)
+    assert len(found) == 550
+    assert sorted(found.id) == list(range(1, 551))
+
+
+def test_rtree_cleanup(tmpdir):
+    from sqlalchemy import text
+    db_fn = str(tmpdir.join('old.db'))
+    database.connect(db_fn)
+    session = database.Session()
+    ingest = database.ASHDIngest(session, 'old-run')
+    ingest.add_all('tile-0', fake_catalog(100))
+    # a database from before the delete trigger, with stale rows
+    session.execute(text('DROP TRIGGER source_rtree_delete'))
+    session.execute(database.Source.__table__.delete().where(
+        database.Source.id > 60))
+    session.commit()
+    count = 'SELECT count(*) FROM source_rtree'
+    assert session.execute(text(count)).scalar() == 100
+    session.close()
+    database.Session.remove()
+
+    # the cleanup runs once, when the trigger is created
+    database.connect(db_fn)
+    session = database.Session()
+    assert session.execute(text(count)).scalar() == 60
+    session.close()
+    database.Session.remove()
+
+
+def test_parquet_catalog(tmpdir):
+    pytest.importorskip('pyarrow')
+    path = str(tmpdir.join('run'))
+    cat = fake_catalog(500, seed=2, ra_range=(-20, 20), dec_range=(-20, 20))
+    cat['ra'] %= 360
+    database.write_catalog(cat.iloc[:300], path, 'tile-0')
+    database.write_catalog(cat.iloc[300:], path, 'tile-1')
+
+    everything = database.read_catalog(path)
+    assert len(everything) == 500
+    assert sorted(everything.ra) == sorted(cat.ra)
+
+    found = database.read_catalog(path, columns=['ra', 'dec', 'mag_auto'],
+                                  ra_range=(350, 10), dec_range=(-5, 5))
+    in_box = ((cat.ra >= 350) | (cat.ra <= 10)) & (cat.dec.abs() <= 5)
+    assert list(found.columns) == ['ra', 'dec', 'mag_auto']
+    assert sorted(found.ra) == sorted(cat.ra[in_box])
+
+    # rewriting an image replaces its rows
+    database.write_catalog(cat.iloc[300:], path, 'tile-1')
+    assert len(database.read_catalog(path, columns=['ra'])) == 500
+
+    # including those in cells its new catalog no longer touches,
+    # but not those of another image with a longer label
+    database.write_catalog(cat.iloc[:10], path, 'tile-1-2')
+    database.write_catalog(cat.iloc[300:301], path, 'tile-1')
+    found = database.read_catalog(path, columns=['ra', 'image_label'])
+    assert len(found) == 311
+    assert sorted(found.ra[found.image_label == 'tile-1']) == [cat.ra[300]]
+
+
+def test_source_counts(session):
+    database.ASHDIngest(session, 'run-0').add_batch(
+        [('tile-0', fake_catalog(30)), ('tile-1', fake_catalog(10))])
+    database.ASHDIngest(session, 'run-1').add_batch(
+        [('tile-2', fake_catalog(5))])
+    assert database.source_counts(session) == {
+        'tile-0': 30, 'tile-1': 10, 'tile-2': 5}
+    assert database.source_counts(session, 'run-1') == {'tile-2': 5}
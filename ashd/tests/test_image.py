@@ -0,0 +1,70 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+from astropy.io import fits
+from ashd.butler import Butler
+from ashd.image import ASHDImage
+
+
+def test_single_open(tile_dir, monkeypatch):
+    b = Butler(tile_dir)
+    calls = []
+    fits_open = fits.open
+    def counting_open(*args, **kwargs):
+        calls.append(args[0])
+        return fits_open(*args, **kwargs)
+    monkeypatch.setattr(fits, 'open', counting_open)
+    img = b.get_image(70.0, -30.0)
+    assert len(calls) == 1
+    assert img.image_fn.endswith('F0440-30_2.fits')
+    assert img.header['SB_SIG'] == 3.0
+    assert img.zpt == 20.0
+    assert img.data.shape == (64, 64)
+    assert img.data.dtype.isnative
+    ra, dec = img.pix_to_sky([31.5, 31.5])
+    assert np.isclose(ra, 70.0) and np.isclose(dec, -30.0)
+
+
+def test_pixel_cache(tile_dir, tmpdir):
+    import os
+    b = Butler(tile_dir)
+    cache_dir = str(tmpdir.join('cache'))
+    img = b.get_image(0.0, -30.0)
+    assert img._data is None
+    expected = np.array(img.data)
+    img.close()
+
+    cached = ASHDImage(b, image_fn=img.image_fn, cache_dir=cache_dir)
+    assert np.array_equal(cached.data, expected)
+    assert os.path.isfile(cached.cache_fn)
+    assert cached.data.dtype == np.float32 and cached.data.dtype.isnative
+
+    # second load memory maps the sidecar instead of the fits file
+    cached = ASHDImage(b, image_fn=img.image_fn, cache_dir=cache_dir)
+    assert isinstance(cached.data, np.memmap)
+    assert np.array_equal(cached.data, expected)
+
+
+def test_transforms(tile_dir):
+    import pytest
+    b = Butler(tile_dir)
+    img = b.get_image(70.0, -30.0)
+    x, y = np.meshgrid(np.linspace(-10, 74, 20), np.linspace(-10, 74, 20))
+    ra, dec = img.xy_to_radec(x, y)
+    assert ra.shape == x.shape
+    assert np.allclose(img.pix_to_sky(np.column_stack([x.ravel(), y.ravel()])),
+                       np.column_stack([ra.ravel(), dec.ravel()]))
+    assert np.allclose(img.sky_to_pix([ra[3, 4], dec[3, 4]]), [x[3, 4], y[3, 4]])
+
+    ra_fast, dec_fast = img.xy_to_radec(x, y, fast=True)
+    assert np.allclose(ra_fast, ra, rtol=0, atol=1e-12)
+    assert np.allclose(dec_fast, dec, rtol=0, atol=1e-12)
+    x_fast, y_fast = img.radec_to_xy(ra, dec, fast=True)
+    assert np.allclose(x_fast, x, rtol=0, atol=1e-8)
+    assert np.allclose(y_fast, y, rtol=0, atol=1e-8)
+
+    img.wcs.wcs.ctype = ['RA---TAN-SIP', 'DEC--TAN-SIP']
+    img._tan_params = None
+    with pytest.raises(ValueError):
+        img.xy_to_radec(x, y, fast=True)
@@ -0,0 +1,89 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+import pytest
+from ashd.imutils import rmedian
+
+
+def _test_image(dtype='f4', shape=(120, 131)):
+    rng = np.random.RandomState(0)
+    data = rng.normal(100, 10, shape)
+    data[5:9, 5:30] = 500
+    data[20:25] = 0
+    return data.astype(dtype)
+
+
+@pytest.mark.parametrize('dtype', ['f4', 'f8', 'i2'])
+def test_rmedian_histogram(dtype):
+    pytest.importorskip('numba')
+    data = _test_image(dtype)
+    expected = rmedian(data, 5, 8)
+    result = rmedian(data, 5, 8, method='histogram')
+    assert result.dtype == expected.dtype
+    assert np.array_equal(result, expected)
+    result = rmedian(data, 2, 4, method='histogram', nbins=16)
+    assert np.array_equal(result, rmedian(data, 2, 4))
+
+
+@pytest.mark.parametrize('n_threads', [1, 3])
+def test_rmedian_histogram_nan(n_threads):
+    pytest.importorskip('numba')
+    data = _test_image()
+    data[40:44, 60:70] = np.nan
+    data[90, 10] = np.inf
+    expected = rmedian(data, 5, 8)
+    assert np.isnan(expected).any()
+    result = rmedian(data, 5, 8, method='histogram', n_threads=n_threads)
+    np.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.parametrize('method', ['scipy', 'histogram'])
+def test_rmedian_threads(method):
+    if method == 'histogram':
+        pytest.importorskip('numba')
+    data = _test_image()
+    expected = rmedian(data, 5, 8)
+    for n_threads in [2, 3, 7]:
+        result = rmedian(data, 5, 8, method=method, n_threads=n_threads)
+        assert np.array_equal(result, expected)
+
+
+def test_rmedian_binned():
+    from scipy import ndimage as ndi
+    data = _test_image('f4', (128, 96))
+    expected = rmedian(data, 5, 8)
+    assert np.array_equal(rmedian(data, 5, 8, binning=1), expected)
+    for binning in [2, 3, 4]:
+        result = rmedian(data, 5, 8, binning=binning)
+        assert result.shape == data.shape
+        assert result.dtype == data.dtype
+        # documented bound: the local range of the image
+        size = 2*int(np.ceil(8 + 1.5*binning)) + 1
+        local_range = ndi.maximum_filter(data, size) - \
+                      ndi.minimum_filter(data, size)
+        assert np.all(np.abs(result - expected) <= local_range + 1e-3)
+
+    # the ring must keep at least one pixel after scaling
+    assert rmedian(data, 5, 8, binning=8).shape == data.shape
+    for binning in [10, 12, 16]:
+        with pytest.raises(ValueError, match='largest binning .* is 8'):
+            rmedian(data, 5, 8, binning=binning)
+
+
+def test_kernel_registry():
+    from ashd import imutils, PipeParams
+    fp = imutils._ring(5, 8)
+    assert fp is imutils._ring(5.0, 8.0, dtype=int)
+    assert not fp.flags.writeable
+    assert imutils.exp_kern(3, 11) is imutils.exp_kern(3, 11, mode='center')
+    p1, p2 = PipeParams(), PipeParams()
+    kern = p1.sep_extract_kws['filter_kernel']
+    assert kern is p2.sep_extract_kws['filter_kernel']
+    assert np.isclose(kern.sum(), 1) and kern.shape == (31, 31)
+    p2.gauss_fwhm = 3.0
+    assert p2.sep_extract_kws['filter_kernel'] is not kern
+    p2.kernel = np.ones((3, 3))
+    assert np.allclose(p2.sep_extract_kws['filter_kernel'], 1/9)
+    p2.kernel = None
+    assert p2.sep_extract_kws['filter_kernel'] is None
@@ -0,0 +1,90 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import logging
+import numpy as np
+import pytest
+from ashd import Butler, PipeParams, utils
+from ashd import pipeline
+
+
+@pytest.fixture
+def params(monkeypatch):
+    monkeypatch.setattr(utils, 'get_logger', 
+                        lambda **kwargs: logging.getLogger('ashd-test'))
+    params = PipeParams()
+    params.r_inner, params.r_outer = 2.0, 3.0
+    params.bw = params.bh = 16
+    params.minarea = 3
+    params.thresh = 0.5
+    return params
+
+
+def test_stage_cache(tile_dir, tmpdir, params, monkeypatch):
+    b = Butler(tile_dir)
+    pipe = pipeline.ASHDPipe(0.0, -30.0, params=params, butler=b)
+    pipe.detect()
+    expected = pipe.sources
+
+    params.stage_cache_dir = str(tmpdir.join('stages'))
+    pipe = pipeline.ASHDPipe(0.0, -30.0, params=params, butler=b)
+    pipe.detect()
+    assert pipe.sources.equals(expected)
+
+    # only the extraction changed, so the ring filter and background 
+    # come from the cache
+    def fail(stage):
+        def func(*args, **kwargs):
+            raise AssertionError(stage + ' recomputed')
+        return func
+    monkeypatch.setattr(pipeline, 'rmedian', fail('ring'))
+    monkeypatch.setattr(pipeline.sep, 'Background', fail('background'))
+    params.thresh = 1.0
+    pipe = pipeline.ASHDPipe(0.0, -30.0, params=params, butler=b)
+    pipe.detect()
+    assert len(pipe.sources) <= len(expected)
+
+    # a new background mesh reuses the ring-filtered image only
+    params.bw = params.bh = 32
+    pipe = pipeline.ASHDPipe(0.0, -30.0, params=params, butler=b)
+    with pytest.raises(AssertionError, match='background recomputed'):
+        pipe.detect()
+
+
+def test_stage_cache_key(tile_dir, tmpdir):
+    from ashd import StageCache
+    cache = StageCache(str(tmpdir))
+    fn = os.path.join(tile_dir, 'F0000-30_1.fits')
+    # numpy parameters (e.g., a grid from np.arange) hash like python ones
+    key = cache.key(fn, 'f4', 'background', dict(bw=64, fthresh=0.5))
+    assert key == cache.key(fn, np.float32, 'background', 
+                            dict(bw=np.int64(64), fthresh=np.float64(0.5)))
+    # pixels loaded with another dtype get their own entries
+    assert key != cache.key(fn, '>i2', 'background', dict(bw=64, fthresh=0.5))
+
+
+def test_sweep(tile_dir, params, monkeypatch):
+    from ashd import sweep
+    b = Butler(tile_dir)
+    grid = dict(thresh=[0.5, 1.0], minarea=[3, 6], r_outer=[3.0, 4.0])
+    calls = []
+    rmedian = pipeline.rmedian
+    def counting_rmedian(*args, **kwargs):
+        calls.append(args[1:3])
+        return rmedian(*args, **kwargs)
+    monkeypatch.setattr(pipeline, 'rmedian', counting_rmedian)
+    results, sources = sweep.sweep(grid, 0.0, -30.0, params=params, 
+                                   butler=b, n_threads=2, n_processes=2,
+                                   return_sources=True)
+    assert len(results) == 8 and len(calls) == 2
+    assert (results.ring_shared == 4).all()
+
+    # same sources as running the pipeline per configuration
+    for i, row in results.iterrows():
+        for name in grid:
+            setattr(params, name, row[name])
+        pipe = pipeline.ASHDPipe(0.0, -30.0, params=params, butler=b)
+        pipe.detect()
+        assert row.n_sources == len(pipe.sources)
+        assert np.array_equal(sources[i].x.values, pipe.sources.x.values)
@@ -0,0 +1,152 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import sys
+import sqlite3
+import numpy as np
+import pandas as pd
+import pytest
+from astropy.io import fits
+from astropy.wcs import WCS
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+                                os.pardir, 'pipelinev2'))
+from reader import Reader, CutoutArchive, SEP_DTYPE, CUTOUT_FN
+
+
+def _fake_findings(n, seed=0):
+    rng = np.random.RandomState(seed)
+    objs = np.zeros(n, dtype=SEP_DTYPE)
+    for name in objs.dtype.names:
+        objs[name] = rng.uniform(0, 1000, n)
+    ra, dec = rng.uniform(0, 360, n), rng.uniform(-90, 90, n)
+    return objs, ra, dec
+
+
+def _write_run(path, objs, ra, dec):
+    # the findings table of a scanner run (see scanner.open_run_db)
+    conn = sqlite3.connect(os.path.join(path, 'db'))
+    conn.execute('create table findings '
+                 '(id text, hash text, ra real, dec real, properties text)')
+    conn.executemany('insert into findings values (?, ?, ?, ?, ?)',
+                     [(np.base_repr(i, 36), 'h', r, d, obj.tobytes())
+                      for i, (obj, r, d) in enumerate(zip(objs, ra, dec))])
+    conn.commit()
+    conn.close()
+
+
+def _load_per_row(path):
+    # the previous Reader.load: one np.fromstring per finding
+    conn = sqlite3.connect(os.path.join(path, 'db'))
+    c = conn.cursor()
+    n = c.execute('select count(*) from findings').fetchone()[0]
+    np_table = np.empty(n, dtype=SEP_DTYPE)
+    extra_data = []
+    for pos, row in enumerate(c.execute('select * from findings')):
+        extra_data.append(row[0:4])
+        np_table[pos] = np.fromstring(row[4], dtype=SEP_DTYPE)
+    conn.close()
+    data = pd.DataFrame(np_table)
+    data['ra'] = [i[2] for i in extra_data]
+    data['dec'] = [i[3] for i in extra_data]
+    return data, extra_data
+
+
+@pytest.mark.filterwarnings('ignore:The binary mode of fromstring')
+def test_load(tmpdir):
+    run_dir = str(tmpdir)
+    _write_run(run_dir, *_fake_findings(1000))
+    expected, extra_data = _load_per_row(run_dir)
+    reader = Reader(run_dir)
+    pd.testing.assert_frame_equal(reader.data, expected)
+    assert reader.extra_data == extra_data
+
+    chunks = list(reader.iter_chunks(chunksize=300))
+    assert [len(c) for c in chunks] == [300, 300, 300, 100]
+    pd.testing.assert_frame_equal(
+        pd.concat(chunks, ignore_index=True), expected)
+
+
+@pytest.mark.filterwarnings('ignore:The binary mode of fromstring')
+def test_load_empty(tmpdir):
+    run_dir = str(tmpdir)
+    objs, ra, dec = _fake_findings(0)
+    _write_run(run_dir, objs, ra, dec)
+    reader = Reader(run_dir)
+    assert len(reader.data) == 0
+    assert list(reader.data.columns) == list(_load_per_row(run_dir)[0].columns)
+    assert list(reader.iter_chunks()) == []
+
+
+def _tile(tile_dir):
+    with fits.open(os.path.join(tile_dir, 'F1200+00_1.fits')) as hdulist:
+        return hdulist[0].data.copy(), hdulist[0].header.copy()
+
+
+def test_cutout_archive(tile_dir, tmpdir):
+    data, header = _tile(tile_dir)
+    run_dir = str(tmpdir.mkdir('run'))
+    conn = sqlite3.connect(os.path.join(run_dir, 'db'))
+    archive = CutoutArchive(run_dir, conn, mode='a')
+    # (xmin, xmax, ymin, ymax) of each cutout
+    boxes = {'A': (5, 20, 10, 30), 'B': (40, 64, 0, 12)}
+    for uid, (x0, x1, y0, y1) in boxes.items():
+        archive.append(uid, data[y0:y1, x0:x1], header, x0, y0)
+    archive.flush()
+    conn.commit()
+    archive.close()
+
+    reader = Reader(run_dir, autoload=False)
+    tile_wcs = WCS(header)
+    for uid, (x0, x1, y0, y1) in boxes.items():
+        hdu = reader.get_img(uid)
+        assert np.array_equal(hdu.data, data[y0:y1, x0:x1])
+        # the cutout's WCS puts its pixels where they are on the tile
+        y, x = np.mgrid[:y1 - y0, :x1 - x0]
+        ra, dec = WCS(hdu.header).all_pix2world(x, y, 0)
+        tile_ra, tile_dec = tile_wcs.all_pix2world(x + x0, y + y0, 0)
+        assert np.allclose(ra, tile_ra, rtol=0, atol=1e-9)
+        assert np.allclose(dec, tile_dec, rtol=0, atol=1e-9)
+    assert reader.get_img(11).header == reader.get_img('B').header
+
+    # bytes appended by a group that never committed are dropped on
+    # reopen, and the archive keeps appending after the last commit
+    fn = os.path.join(run_dir, CUTOUT_FN)
+    committed = os.path.getsize(fn)
+    archive = CutoutArchive(run_dir, conn, mode='a')
+    archive.append('C', data[:8, :8], header, 0, 0)
+    archive.flush()
+    conn.rollback()
+    archive.close()
+    assert os.path.getsize(fn) > committed
+    archive = CutoutArchive(run_dir, conn, mode='a')
+    assert os.path.getsize(fn) == committed
+    assert 'C' not in archive
+    archive.append('D', data[2:6, 3:9], header, 3, 2)
+    archive.flush()
+    conn.commit()
+    archive.close()
+    assert np.array_equal(archive.get('D').data, data[2:6, 3:9])
+    assert np.array_equal(archive.get('A').data, data[10:30, 5:20])
+    conn.close()
+
+
+def test_cutout_fits_fallback(tile_dir, tmpdir):
+    data, header = _tile(tile_dir)
+    # runs from before the archive wrote one fits file per finding
+    run_dir = str(tmpdir.mkdir('run'))
+    sqlite3.connect(os.path.join(run_dir, 'db')).close()
+    fits.writeto(os.path.join(run_dir, 'Z.fits'), data[:10, :10], header)
+    reader = Reader(run_dir, autoload=False)
+    assert reader.archive is None
+    assert np.array_equal(reader.get_img('Z').data, data[:10, :10])
+    assert np.array_equal(reader.get_img(35).data, data[:10, :10])
+
+    # findings missing from an archive also fall back to their file
+    conn = sqlite3.connect(os.path.join(run_dir, 'db'))
+    CutoutArchive(run_dir, conn, mode='a').close()
+    conn.close()
+    reader = Reader(run_dir, autoload=False)
+    assert reader.archive is not None
+    assert np.array_equal(reader.get_img('Z').data, data[:10, :10])
@@ -0,0 +1,75 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import sys
+import sqlite3
+import subprocess
+import pytest
+from conftest import TILES, make_tile
+
+PIPELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            os.pardir, 'pipelinev2')
+sys.path.insert(0, PIPELINE_DIR)
+from reader import Reader
+
+
+@pytest.fixture
+def scan_dir(tmpdir):
+    # full-size tiles with sources, one per field
+    path = str(tmpdir.mkdir('tiles'))
+    for seed, (fn, sb_sig) in enumerate(TILES):
+        if fn != 'F0440-30_2.fits':
+            make_tile(path, fn, sb_sig, size=2048, seed=seed, n_blobs=40)
+    return path
+
+
+def _scan(source, output_dir, *args):
+    # objhash uses hash(), which is salted per interpreter
+    env = dict(os.environ, PYTHONHASHSEED='0')
+    package_dir = os.path.join(PIPELINE_DIR, os.pardir, os.pardir)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.abspath(package_dir), env.get('PYTHONPATH', '')])
+    proc = subprocess.run(
+        [sys.executable, 'scanner.py', '--source', source,
+         '--output-dir', output_dir, '--processes', '2'] + list(args),
+        cwd=PIPELINE_DIR, env=env, stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT, universal_newlines=True)
+    assert proc.returncode == 0, proc.stdout
+    return proc.stdout
+
+
+def _results(output_dir):
+    # the findings (without the ids, which follow the completion
+    # order), their cutouts, and the manifest of finished tiles
+    reader = Reader(output_dir)
+    conn = reader.conn
+    findings = sorted(
+        (h, ra, dec, props, reader.get_img(uid).data.tobytes())
+        for uid, h, ra, dec, props in conn.execute('select * from findings'))
+    ids = [row[0] for row in conn.execute('select id from findings')]
+    assert len(set(ids)) == len(ids)
+    tiles = sorted(conn.execute('select * from tiles'))
+    conn.close()
+    return findings, tiles
+
+
+def test_resume(scan_dir, tmpdir):
+    full_dir = str(tmpdir.join('full'))
+    _scan(scan_dir, full_dir)
+    expected = _results(full_dir)
+    assert len(expected[0]) > 0 and len(expected[1]) == 4
+
+    run_dir = str(tmpdir.join('run'))
+    log = _scan(scan_dir, run_dir, '--max-processed', '2')
+    assert 'Processing 2 coordinates.' in log
+    log = _scan(scan_dir, run_dir)
+    assert '2 of 4 tiles already finished.' in log
+    assert 'Processing 2 coordinates.' in log
+    assert _results(run_dir) == expected
+
+    # a finished run has nothing left to dispatch
+    log = _scan(scan_dir, run_dir)
+    assert '4 of 4 tiles already finished.' in log
+    assert 'Processing 0 coordinates.' in log
+    assert _results(run_dir) == expected
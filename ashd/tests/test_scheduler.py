@@ -0,0 +1,62 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import time
+import multiprocessing
+import numpy as np
+from ashd import Butler, Scheduler, tile_costs
+
+
+def _sleep(task):
+    time.sleep(task * 1e-3)
+    return task
+
+
+def _fail_on_5(task):
+    if task == 5:
+        raise RuntimeError('internal pixel buffer full')
+    return _sleep(task)
+
+
+def test_tile_costs(tile_dir):
+    b = Butler(tile_dir)
+    costs = tile_costs(b)
+    lat = np.abs(b.unique_coords.galactic.b.deg)
+    assert np.all(np.diff(costs[np.argsort(lat)]) <= 0)
+
+    # cached counts override the model, which is scaled to them
+    label = 'F1200+00_1'
+    field_id = b.get_field_id(b.fn_coords[b.files.index(label + '.fits')])
+    counts = tile_costs(b, {label: 1000})
+    assert counts[field_id] == 1000
+    assert np.allclose(counts / costs, 1000 / costs[field_id])
+
+
+def test_scheduler():
+    tasks = [1, 20, 5, 40, 2, 10]
+    scheduler = Scheduler(tasks, chunksize=2)
+    assert [tasks[i] for i in scheduler.order()] == [40, 20, 10, 5, 2, 1]
+    pool = multiprocessing.Pool(2)
+    results = list(scheduler.run(pool, _sleep, tasks))
+    pool.close()
+    pool.join()
+    assert sorted(results) == sorted(tasks)
+    report = scheduler.utilization()
+    assert report.n_tasks.sum() == len(tasks)
+    assert np.all((report.utilization > 0) & (report.utilization <= 1))
+
+
+def test_scheduler_failure():
+    tasks = [1, 20, 5, 40, 2, 10]
+    scheduler = Scheduler(tasks)
+    pool = multiprocessing.Pool(2)
+    results = list(scheduler.run(pool, _fail_on_5, tasks))
+    pool.close()
+    pool.join()
+    assert sorted(results) == [1, 2, 10, 20, 40]
+    assert len(scheduler.failures) == 1
+    task, error = scheduler.failures[0]
+    assert task == 5
+    assert 'internal pixel buffer full' in error
+    assert scheduler.utilization().n_tasks.sum() == len(tasks)
+    assert '1 failed' in scheduler.summary()
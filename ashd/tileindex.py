@@ -0,0 +1,150 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import warnings
+import numpy as np
+from astropy.io import fits
+from astropy.wcs import WCS
+
+__all__ = ['TileIndex', 'parse_tile_fn', 'INDEX_FN']
+
+INDEX_FN = '.ashd-tile-index.npy'
+
+# (column name, dtype) for everything we keep per tile besides the file name
+INDEX_COLUMNS = [
+    ('ra', 'f8'), ('dec', 'f8'), ('sb_sig', 'f8'), ('zeropt', 'f8'),
+    ('naxis1', 'i4'), ('naxis2', 'i4'), ('ctype1', 'U16'), ('ctype2', 'U16'),
+    ('crval1', 'f8'), ('crval2', 'f8'), ('crpix1', 'f8'), ('crpix2', 'f8'),
+    ('cd1_1', 'f8'), ('cd1_2', 'f8'), ('cd2_1', 'f8'), ('cd2_2', 'f8'),
+    ('mtime', 'f8'), ('size', 'i8')
+]
+
+
+def parse_tile_fn(fn):
+    """
+    Get the tile-center coordinates from a stack file name.
+
+    Parameters
+    ----------
+    fn : str
+        File name of the form Fhhmm[+-]dd_*.fits.
+
+    Returns
+    -------
+    ra, dec : float
+        Tile center in degrees.
+    """
+    _ra = int(fn[1:5])
+    if _ra > 2400:
+        _ra = _ra - 2400
+    ra = 15.0 * (_ra // 100 + (_ra % 100) / 60.0)
+    dec = float(int(fn[5:8]))
+    return ra, dec
+
+
+def _index_dtype(fn_len):
+    return np.dtype([('fn', 'U{}'.format(max(fn_len, 1)))] + INDEX_COLUMNS)
+
+
+class TileIndex(object):
+    """
+    On-disk index of the stacked images in a data directory.
+
+    The index is a numpy structured array saved next to the stacks,
+    which is memory mapped on load. Only files that were added or
+    changed (by mtime and size) since the last update have their
+    headers read.
+
+    Parameters
+    ----------
+    data_dir : str
+        Directory with the stacked images.
+    index_fn : str, optional
+        Index file name. Defaults to INDEX_FN in data_dir.
+    update : bool, optional
+        If True, sync the index with the contents of data_dir.
+    """
+
+    def __init__(self, data_dir, index_fn=None, update=True):
+        self.data_dir = data_dir
+        self.index_fn = index_fn if index_fn else os.path.join(
+            data_dir, INDEX_FN)
+        if os.path.isfile(self.index_fn):
+            self.table = np.load(self.index_fn, mmap_mode='r')
+        else:
+            self.table = np.zeros(0, dtype=_index_dtype(1))
+        if update:
+            self.update()
+
+    def __len__(self):
+        return len(self.table)
+
+    def __getitem__(self, key):
+        return self.table[key]
+
+    @property
+    def files(self):
+        return self.table['fn'].tolist()
+
+    def _read_row(self, fn, stat):
+        header = fits.getheader(os.path.join(self.data_dir, fn))
+        ra, dec = parse_tile_fn(fn)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            cd = WCS(header).pixel_scale_matrix
+        return (fn, ra, dec, header.get('SB_SIG', np.nan),
+                header.get('ZEROPT', np.nan),
+                header.get('NAXIS1', 0), header.get('NAXIS2', 0),
+                header.get('CTYPE1', ''), header.get('CTYPE2', ''),
+                header.get('CRVAL1', np.nan), header.get('CRVAL2', np.nan),
+                header.get('CRPIX1', np.nan), header.get('CRPIX2', np.nan),
+                cd[0, 0], cd[0, 1], cd[1, 0], cd[1, 1],
+                stat.st_mtime, stat.st_size)
+
+    def update(self):
+        """
+        Sync the index with data_dir and write it to disk if
+        anything changed.
+
+        Returns
+        -------
+        changed : bool
+            True if the index was modified.
+        """
+        stats = {e.name: e.stat() for e in os.scandir(self.data_dir)
+                 if e.name[-4:]=='fits' and e.is_file()}
+        known = {fn: i for i, fn in enumerate(self.table['fn'].tolist())}
+
+        rows = []
+        changed = len(known) != len(stats)
+        for fn in sorted(stats):
+            st = stats[fn]
+            i = known.get(fn)
+            if i is not None and self.table['mtime'][i] == st.st_mtime \
+                    and self.table['size'][i] == st.st_size:
+                rows.append(self.table[i].tolist())
+            else:
+                rows.append(self._read_row(fn, st))
+                changed = True
+
+        if changed:
+            fn_len = max([len(r[0]) for r in rows]) if rows else 1
+            self.table = np.array(rows, dtype=_index_dtype(fn_len))
+            self.write()
+        return changed
+
+    def write(self):
+        """
+        Atomically write the index to index_fn. A read-only data
+        directory is not an error; the index is then kept in memory.
+        """
+        tmp_fn = self.index_fn + '.{}.tmp'.format(os.getpid())
+        try:
+            with open(tmp_fn, 'wb') as f:
+                np.save(f, np.ascontiguousarray(self.table))
+            os.replace(tmp_fn, self.index_fn)
+        except OSError as e:
+            warnings.warn('could not write tile index: {}'.format(e))
+            if os.path.isfile(tmp_fn):
+                os.remove(tmp_fn)
@@ -2,7 +2,7 @@ import os
 import numpy as np
 
 __all__ = ['pixscale', 'project_dir', 'ndarray_byteswap', 
-           'isiterable', 'get_logger']
+           'isiterable', 'get_logger', 'radec_to_xyz']
 
 pixscale = 7.8 # arcsec/pixel
 project_dir = os.path.dirname(os.path.dirname(__file__))
@@ -14,10 +14,24 @@ def ndarray_byteswap(arr):
     always returns), swap to little-endian for SEP.
     """
     if arr.dtype.byteorder=='>':
-        arr = arr.byteswap().newbyteorder()
+        # swap and relabel the byte order in a single copy
+        arr = arr.astype(arr.dtype.newbyteorder('<'))
     return arr
 
 
+def radec_to_xyz(ra, dec):
+    """
+    Convert ra and dec in degrees to unit vectors on the sphere.
+    Euclidean distances between these vectors are monotonic with 
+    angular separation, so they can be used in a KD-tree.
+    """
+    ra = np.deg2rad(ra)
+    dec = np.deg2rad(dec)
+    cos_dec = np.cos(dec)
+    return np.stack(
+        [cos_dec*np.cos(ra), cos_dec*np.sin(ra), np.sin(dec)], axis=-1)
+
+
 def isiterable(obj):
     """
     Returns `True` if the given object is iterable.
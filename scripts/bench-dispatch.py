@@ -0,0 +1,78 @@
+#!/usr/bin/env python 
+"""
+Benchmark the per-task dispatch overhead of the scanner's pool: 
+passing the Butler with every task (the previous scanner) versus 
+building it once per worker in a pool initializer and sending only 
+the field id. The tasks only resolve their tile's file name, so the 
+timings are dominated by dispatch. With --unwritable-index the tile 
+index cannot be saved, so the workers have to rebuild it to get the 
+same field ids as the main process; the results are checked against 
+the main process either way.
+"""
+import os
+import time
+import pickle
+import tempfile
+import multiprocessing
+import ashd
+
+butler = None
+
+
+def init_worker(data_dir, index_fn, files):
+    global butler
+    butler = ashd.Butler(data_dir, index_fn=index_fn, update_index=False, 
+                         files=files)
+
+
+def task_before(coord, butler):
+    return butler.get_image_fn(coord)
+
+
+def task_after(field_id):
+    return butler.get_image_fn(butler.unique_coords[field_id])
+
+
+def bench(pool, func, args_list):
+    start = time.time()
+    results = [pool.apply_async(func, args=args) for args in args_list]
+    results = [r.get() for r in results]
+    return (time.time() - start) / len(args_list), results
+
+
+if __name__=='__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('data_dir', type=str)
+    parser.add_argument('-n', '--num-tasks', type=int, default=None)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--unwritable-index', action='store_true')
+    args = parser.parse_args()
+
+    index_fn = None
+    if args.unwritable_index:
+        index_fn = os.path.join(tempfile.mkdtemp(), 'missing', 'index.npy')
+    main_butler = ashd.Butler(args.data_dir, index_fn=index_fn)
+    num_tasks = args.num_tasks or len(main_butler.unique_coords)
+    field_ids = [i % len(main_butler.unique_coords) for i in range(num_tasks)]
+
+    with multiprocessing.Pool(args.processes) as pool:
+        before, expected = bench(pool, task_before, 
+                       [(main_butler.unique_coords[i], main_butler) 
+                        for i in field_ids])
+    start = time.time()
+    with multiprocessing.Pool(args.processes, initializer=init_worker, 
+                              initargs=(args.data_dir, index_fn, 
+                                        main_butler.files)) as pool:
+        pool.apply(len, ([],))
+        startup = time.time() - start
+        after, results = bench(pool, task_after, [(i,) for i in field_ids])
+    assert results == expected, 'workers resolved different tiles'
+
+    print('tiles: {}, tasks: {}'.format(len(main_butler.files), num_tasks))
+    print('pickled butler: {:.1f} kB'.format(
+        len(pickle.dumps(main_butler)) / 1e3))
+    print('worker start-up with initializer: {:.1f} ms'.format(startup*1e3))
+    print('before: {:.3f} ms/task'.format(before*1e3))
+    print('after:  {:.3f} ms/task'.format(after*1e3))
+    print('speedup: {:.1f}x'.format(before/after))
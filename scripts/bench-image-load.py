@@ -0,0 +1,56 @@
+#!/usr/bin/env python 
+"""
+Benchmark per-image load time of ASHDImage against the previous 
+loading path, which resolved the tile three times and opened the 
+file twice (once for the header and once for the data).
+"""
+import time
+import numpy as np
+from astropy.wcs import WCS
+import ashd
+
+
+# both paths read every pixel, so the lazy data of ASHDImage is 
+# timed too, and release the file before the next image
+def load_before(butler, ra, dec):
+    header = butler.get_header(ra, dec)
+    image_fn = butler.get_image_fn(ra, dec)
+    data = ashd.ndarray_byteswap(butler.get_data(ra, dec))
+    return header, data.sum(), WCS(header), image_fn
+
+
+def load_after(butler, ra, dec):
+    with ashd.ASHDImage(butler, ra=ra, dec=dec) as img:
+        return img.header, img.data.sum(), img.wcs, img.image_fn
+
+
+def bench(func, butler, coords):
+    start = time.time()
+    for ra, dec in coords:
+        func(butler, ra, dec)
+    return (time.time() - start) / len(coords)
+
+
+if __name__=='__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('data_dir', type=str)
+    parser.add_argument('-n', '--num-images', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    butler = ashd.Butler(args.data_dir)
+    rng = np.random.RandomState(args.seed)
+    idx = rng.choice(len(butler.unique_coords), 
+                     min(args.num_images, len(butler.unique_coords)), 
+                     replace=False)
+    coords = [(c.ra.deg, c.dec.deg) for c in butler.unique_coords[idx]]
+
+    # warm the page cache so both paths see the same disk state
+    bench(load_after, butler, coords)
+    before = bench(load_before, butler, coords)
+    after = bench(load_after, butler, coords)
+    print('images loaded: {}'.format(len(coords)))
+    print('before: {:.2f} ms/image'.format(before*1e3))
+    print('after:  {:.2f} ms/image'.format(after*1e3))
+    print('speedup: {:.2f}x'.format(before/after))
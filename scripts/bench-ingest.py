@@ -0,0 +1,80 @@
+#!/usr/bin/env python 
+"""
+Benchmark catalog ingestion into the sqlite database: one 
+ASHDIngest.add_all (DataFrame.to_sql) per tile versus 
+ASHDIngest.add_batch over batches of tiles. The defaults are roughly a 
+full-sky run (~3,600 fields); use --n-tiles to scale down.
+"""
+import os
+import time
+import tempfile
+import numpy as np
+import pandas as pd
+from ashd import database
+
+SEP_COLUMNS = ['x', 'y', 'x2', 'y2', 'xy', 'errx2', 'erry2', 'errxy', 
+               'xmin', 'xmax', 'ymin', 'ymax', 'thresh', 'npix', 'tnpix', 
+               'a', 'b', 'theta', 'cxx', 'cyy', 'cxy', 'cflux', 'flux', 
+               'cpeak', 'peak', 'xcpeak', 'ycpeak', 'xpeak', 'ypeak', 'flag',
+               'ra', 'dec', 'mag_auto', 'flux_auto', 'flux_radius']
+
+
+def fake_catalog(num_sources, rng):
+    cat = pd.DataFrame({c: rng.uniform(0, 100, num_sources) 
+                        for c in SEP_COLUMNS})
+    for c in ['npix', 'tnpix', 'flag']:
+        cat[c] = cat[c].astype(int)
+    return cat
+
+
+def ingest_per_tile(db_fn, catalogs):
+    database.connect(db_fn, overwrite=True)
+    session = database.Session()
+    start = time.time()
+    for label, cat in catalogs:
+        database.ASHDIngest(session, 'bench').add_all(label, cat)
+    dt = time.time() - start
+    session.close()
+    database.Session.remove()
+    return dt
+
+
+def ingest_batched(db_fn, catalogs, batch_size):
+    database.connect(db_fn, overwrite=True)
+    session = database.Session()
+    start = time.time()
+    ingest = database.ASHDIngest(session, 'bench')
+    for i in range(0, len(catalogs), batch_size):
+        ingest.add_batch(catalogs[i:i + batch_size])
+    dt = time.time() - start
+    session.close()
+    database.Session.remove()
+    return dt
+
+
+if __name__=='__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--n-tiles', type=int, default=3600)
+    parser.add_argument('--n-sources', type=int, default=1500)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--out-dir', type=str, default=tempfile.gettempdir())
+    parser.add_argument('--skip-per-tile', action='store_true')
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(1)
+    catalogs = [('tile-{}'.format(i), fake_catalog(args.n_sources, rng)) 
+                for i in range(args.n_tiles)]
+    n_rows = args.n_tiles * args.n_sources
+    print('{} tiles x {} sources = {} rows'.format(
+        args.n_tiles, args.n_sources, n_rows))
+
+    db_fn = os.path.join(args.out_dir, 'bench-ingest.db')
+    if not args.skip_per_tile:
+        dt = ingest_per_tile(db_fn, catalogs)
+        print('add_all per tile:  {:8.2f} s  ({:.0f} rows/s)'.format(
+            dt, n_rows/dt))
+    dt = ingest_batched(db_fn, catalogs, args.batch_size)
+    print('add_batch ({:>4}):  {:8.2f} s  ({:.0f} rows/s)'.format(
+        args.batch_size, dt, n_rows/dt))
+    os.remove(db_fn)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python 
+"""
+Benchmark and validate the rmedian ring-filter methods on a full 
+2048x2048 tile. If no data directory is given, a noise image is used.
+The approximate (binned) filter is compared to the exact one in units
+of the image noise, estimated from the median absolute deviation.
+"""
+import time
+import numpy as np
+import ashd
+
+
+def bench(data, r_inner, r_outer, n_repeat=1, **kwargs):
+    times = []
+    for _ in range(n_repeat):
+        start = time.time()
+        result = ashd.rmedian(data, r_inner, r_outer, **kwargs)
+        times.append(time.time() - start)
+    return result, min(times)
+
+
+if __name__=='__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--data-dir', type=str, default=None)
+    parser.add_argument('--ra', type=float, default=150.0)
+    parser.add_argument('--dec', type=float, default=30.0)
+    parser.add_argument('--r-inner', type=float, default=5.0)
+    parser.add_argument('--r-outer', type=float, default=8.0)
+    parser.add_argument('--n-repeat', type=int, default=3)
+    parser.add_argument('--n-threads', type=int, default=1)
+    parser.add_argument('--binning', type=int, nargs='*', default=[2, 4, 8])
+    args = parser.parse_args()
+
+    if args.data_dir is None:
+        rng = np.random.RandomState(1)
+        data = rng.normal(100, 10, (2048, 2048)).astype(np.float32)
+        label = 'noise'
+    else:
+        image = ashd.Butler(args.data_dir).get_image(args.ra, args.dec)
+        data = np.asarray(image.data)
+        label = image.image_fn
+
+    radii = (args.r_inner, args.r_outer)
+    # compile the numba kernel before timing
+    ashd.rmedian(data[:64, :64], *radii, method='histogram')
+
+    print('image: {} {}'.format(label, data.shape))
+    expected, t_ref = bench(data, *radii, n_repeat=args.n_repeat)
+    print('{:<12} {:7.2f} s'.format('scipy', t_ref))
+    runs = [('histogram', 1)]
+    if args.n_threads > 1:
+        runs = [('scipy', args.n_threads)] + runs + \
+               [('histogram', args.n_threads)]
+    for method, n_threads in runs:
+        result, t = bench(data, *radii, n_repeat=args.n_repeat, 
+                          method=method, n_threads=n_threads)
+        print('{:<12} {:7.2f} s  speedup = {:.1f}x  identical = {}'.format(
+            '{}/{}'.format(method, n_threads), t, t_ref/t, 
+            np.array_equal(result, expected)))
+
+    mad = np.median(np.abs(data - np.median(data)))
+    sigma = 1.4826 * mad
+    print('approximate ring median, errors in units of the image noise '
+          '({:.3g}):'.format(sigma))
+    for binning in args.binning:
+        result, t = bench(data, *radii, n_repeat=args.n_repeat, 
+                          method='histogram', binning=binning)
+        err = np.abs(result.astype(float) - expected) / sigma
+        print('binning={:<4} {:7.2f} s  speedup = {:.1f}x  '
+              'rms = {:.3f}  p99 = {:.3f}  max = {:.3f}'.format(
+              binning, t, t_ref/t, np.sqrt(np.mean(err**2)), 
+              np.percentile(err, 99), err.max()))
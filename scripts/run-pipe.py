@@ -5,7 +5,6 @@ import numpy as np
 import pandas as pd
 from astropy.convolution import Tophat2DKernel
 import schwimmbad
-import mpi4py.MPI as MPI
 import ashd
 out_dir= '/Users/protostar/local_data/asas-sn-hd-io'
 db_fn = os.path.join(out_dir, 'asas-sn-hd.db')
@@ -24,7 +23,7 @@ class Worker(object):
         params.bw = 128
         ra, dec = coord.ra.value, coord.dec.value
         try:
-            pipe = ashd.ASHDPipe(ra, dec, params=params)
+            pipe = ashd.ASHDPipe(ra, dec, params=params, butler=self.butler)
             pipe.logger.info('current image: '+pipe.image_label)
             pipe.detect()
             pipe.calc_auto_params()
@@ -34,22 +33,36 @@ class Worker(object):
             pipe.logger.error(e, ra, dec, 'failed')
             return None
 
-    def callback(self, result):
-        if result is not None:
-            image_label, sources = result
-            db_ingest = ashd.database.ASHDIngest(session, self.run_name)
-            db_ingest.add_all(image_label, sources)
-
     def __call__(self, task):
         return self.work(task)
 
 
-def main(pool, run_name='dev'):
+def main(pool, run_name='dev', chunksize=1):
     worker = Worker(run_name)
     coords = worker.butler.unique_coords
-    for r in pool.map(worker, coords, callback=worker.callback):
-        pass
+    # source counts of earlier runs (else a Galactic latitude model) 
+    # put the dense tiles at the front of the queue
+    counts = None
+    if os.path.isfile(db_fn):
+        ashd.database.connect(db_fn)
+        counts = ashd.database.source_counts(ashd.database.Session())
+    costs = ashd.tile_costs(worker.butler, counts)
+    scheduler = ashd.Scheduler(costs, chunksize=chunksize)
+    # a single writer process owns the database, so the results 
+    # are committed in groups and never hold up the pool
+    sink_args = (db_fn, run_name)
+    with ashd.database.Writer(ashd.database.DatabaseSink, sink_args) as writer:
+        for result in scheduler.run(pool, worker, list(coords)):
+            if result is not None:
+                image_label, sources = result
+                writer.put((image_label, sources, None))
     pool.close()
+    # tasks that raised were skipped rather than written
+    for coord, error in scheduler.failures:
+        print('failed at', coord.ra.deg, coord.dec.deg)
+        print(error)
+    print(scheduler.summary())
+    print(scheduler.utilization())
 
 
 if __name__=='__main__':
@@ -59,12 +72,8 @@ if __name__=='__main__':
     group = parser.add_mutually_exclusive_group()
     group.add_argument("--ncores", dest="n_cores", default=1, type=int)
     group.add_argument("--mpi", dest="mpi", default=False, action="store_true")
+    parser.add_argument("--chunksize", dest="chunksize", default=1, type=int)
     args = parser.parse_args()
 
-    if MPI.COMM_WORLD.Get_rank()==0:
-        # open database session with master process
-        engine = ashd.database.connect(db_fn)
-        session = ashd.database.Session()
-
     pool = schwimmbad.choose_pool(mpi=args.mpi, processes=args.n_cores)
-    main(pool)
+    main(pool, chunksize=args.chunksize)